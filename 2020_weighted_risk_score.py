@@ -1,11 +1,18 @@
-import pandas as pd
 import ast
 from datetime import datetime
 from disease_factors import process_code_2
+from member_keys import encode_member_ids, scatter_by_key
+from model_years import DEMOGRAPHIC_SETTINGS, DISEASE_SETTINGS, get_model_year, stage_settings
+from prefetch import DEMOGRAPHIC_MEMBER_COLUMNS, DISEASE_MEMBER_COLUMNS, prefetch_executor, prefetch_inputs, stage_members
+from stage_cache import StageCache
+from lazy_imports import lazy_import
 
-def load_table_1(file_path):
-    
-    df = pd.read_excel(file_path, sheet_name=0, header=0)
+pd = lazy_import('pandas')
+
+MODEL_YEAR = 2020
+
+def load_table_1(file_path, header=0):
+    df = pd.read_excel(file_path, sheet_name=0, header=header)
     df.columns = ['Variable', 'Description Label', 'Community, NonDual, Aged', 'Community, NonDual, Disabled',
                   'Community, FBDual, Aged', 'Community, FBDual, Disabled', 'Community, PBDual, Aged',
                   'Community, PBDual, Disabled', 'Institutional']
@@ -130,9 +137,11 @@ def extract_target_value(member_id, patient_category, df):
                 return age_row['Community, NonDual, Disabled'].values[0]
     return None
 
-def process_code_1(table_1_path, table_2_path, output_path):
-    df_table_1 = load_table_1(table_1_path)
-    df_table_2 = load_table_2(table_2_path)
+def process_code_1(table_1_path, table_2_path, output_path, df_table_1=None, df_table_2=None):
+    if df_table_1 is None:
+        df_table_1 = load_table_1(table_1_path)
+    if df_table_2 is None:
+        df_table_2 = load_table_2(table_2_path)
     
     print("Table 1 DataFrame:")
     print(df_table_1.head())
@@ -147,22 +156,30 @@ def process_code_1(table_1_path, table_2_path, output_path):
     
     df_table_2.to_excel(output_path, index=False)
     print(f"Data has been saved to {output_path}")
+    return df_table_2
 
-def calculate_adjusted_risk_score(raw_risk_score, normalization_factor=1.069, ma_coding_pattern=5.9 / 100):
+def calculate_adjusted_risk_score(raw_risk_score, normalization_factor=None, ma_coding_pattern=None):
     """
     Calculate the adjusted risk score based on the raw risk score, normalization factor, and MA coding pattern.
 
     Parameters:
     - raw_risk_score: The raw risk score to be adjusted.
-    - normalization_factor: The factor used to normalize the raw risk score.
-    - ma_coding_pattern: The MA coding pattern percentage as a decimal.
+    - normalization_factor: The factor used to normalize the raw risk score
+      (default: the model year's registered value at call time).
+    - ma_coding_pattern: The MA coding pattern percentage as a decimal
+      (default: the model year's registered value at call time).
 
     Returns:
     - Adjusted risk score.
     """
+    model_year = get_model_year(MODEL_YEAR)
+    if normalization_factor is None:
+        normalization_factor = model_year['normalization_factor']
+    if ma_coding_pattern is None:
+        ma_coding_pattern = model_year['ma_coding_pattern']
     return (raw_risk_score / normalization_factor) * (1 - ma_coding_pattern)
 
-def display_and_sum_values(file_path_1, file_path_2):
+def display_and_sum_values(file_path_1, file_path_2, final_output_path=None):
     # Load target value files
     df1 = pd.read_excel(file_path_1)
     df2 = pd.read_excel(file_path_2)
@@ -171,12 +188,13 @@ def display_and_sum_values(file_path_1, file_path_2):
     df1['Target Value'] = pd.to_numeric(df1['Target Value'], errors='coerce').fillna(0)
     df2['Target Value'] = pd.to_numeric(df2['Target Value'], errors='coerce').fillna(0)
     
-    # Merge the dataframes on 'MemberID'
-    df_combined = pd.merge(df1[['MemberID', 'Target Value']], df2[['MemberID', 'Target Value']], on='MemberID', how='outer', suffixes=('_Demographic', '_Disease'))
-    
-    # Fill NaN values with 0
-    df_combined['Target Value_Demographic'] = df_combined['Target Value_Demographic'].fillna(0)
-    df_combined['Target Value_Disease'] = df_combined['Target Value_Disease'].fillna(0)
+    # Outer join on 'MemberID' through integer keys; members missing from a stage get 0
+    (demographic_keys, disease_keys), member_ids = encode_member_ids(df1['MemberID'], df2['MemberID'])
+    df_combined = pd.DataFrame({
+        'MemberID': member_ids,
+        'Target Value_Demographic': scatter_by_key(demographic_keys, df1['Target Value'], len(member_ids), fill_value=0.0),
+        'Target Value_Disease': scatter_by_key(disease_keys, df2['Target Value'], len(member_ids), fill_value=0.0),
+    })
     
     # Calculate the weighted risk score
     df_combined['Raw Risk Score'] = df_combined['Target Value_Demographic'] + df_combined['Target Value_Disease']
@@ -185,40 +203,66 @@ def display_and_sum_values(file_path_1, file_path_2):
     df_combined['Adjusted Risk Score'] = df_combined['Raw Risk Score'].apply(calculate_adjusted_risk_score)
 
      # Calculate the adjusted risk score
-    df_combined['Weighted Risk Score'] = df_combined['Raw Risk Score'].apply(calculate_adjusted_risk_score)*(0.3)
+    df_combined['Weighted Risk Score'] = df_combined['Raw Risk Score'].apply(calculate_adjusted_risk_score) * get_model_year(MODEL_YEAR)['blend_weight']
     
     
     # Assuming age and patient data are included in the demographic file
-    df_patient_data = df1[['MemberID', 'Age']]  # Replace with actual columns
-    df_combined = pd.merge(df_combined, df_patient_data, on='MemberID', how='left')
+    df_combined['Age'] = scatter_by_key(demographic_keys, df1['Age'], len(member_ids))
     
     # Display the relevant data
     print("\nComprehensive Risk Scores and Patient Data:")
     print(df_combined[['MemberID', 'Age', 'Target Value_Demographic', 'Target Value_Disease','Raw Risk Score', 'Adjusted Risk Score','Weighted Risk Score']])
     
     # Save the combined data to an Excel file
-    final_output_path = 'C:/Users/Spencerdm/Downloads/Comprehensive_Risk_Scores_with_Patient_Data_2020.xlsx'
+    if final_output_path is None:
+        final_output_path = 'C:/Users/Spencerdm/Downloads/Comprehensive_Risk_Scores_with_Patient_Data_2020.xlsx'
     df_combined.to_excel(final_output_path, index=False)
     print(f"Comprehensive risk scores and patient data have been saved to {final_output_path}")
+    return df_combined
 
 def main():
-    # Paths for code 1
-    table_1_path_code_1 = 'C:/Users/Spencerdm/OneDrive/Documents/ADT Project/Rate Announcement 2020.xlsx'
-    table_2_path_code_1 = 'C:/Users/Spencerdm/Downloads/For HCC (4).xlsx'
+    model_year = get_model_year(MODEL_YEAR)
+
+    # Member input shared by both stages
+    table_2_path = 'C:/Users/Spencerdm/Downloads/For HCC (4).xlsx'
     output_path_code_1 = 'C:/Users/Spencerdm/Downloads/Patient_Data_Target_Values.xlsx'
-    
-    # Paths for code 2
-    table_1_path_code_2 = 'C:/Users/Spencerdm/OneDrive/Documents/ADT Project/Rate Announcement 2020.xlsx'
-    table_2_path_code_2 = 'C:/Users/Spencerdm/Downloads/For HCC (4).xlsx'
-    icd_to_hcc_path = "C:/Users/Spencerdm/Downloads/2024 Initial ICD-10-CM Mappings/2024 Initial ICD-10-CM Mappings.csv"
     output_path_code_2 = 'C:/Users/Spencerdm/Downloads/hcc_code_target_values.xlsx'
     
-    # Process the files
-    process_code_1(table_1_path_code_1, table_2_path_code_1, output_path_code_1)
-    process_code_2(table_1_path_code_2, table_2_path_code_2, icd_to_hcc_path, output_path_code_2)
+    # Stage outputs are cached by the content of their inputs, their settings and code;
+    # ages depend on the run date, so it is part of the demographic key
+    cache = StageCache()
+    demographic_key = cache.key('demographic', files=[table_2_path, model_year['rate_workbook']], code=[__file__, 'model_years'],
+                                settings=stage_settings(MODEL_YEAR, DEMOGRAPHIC_SETTINGS), as_of=datetime.today().date())
+    disease_key = cache.key('disease', files=[table_2_path, model_year['rate_workbook'], model_year['icd_to_hcc']],
+                            code=['disease_factors', 'model_years'], settings=stage_settings(MODEL_YEAR, DISEASE_SETTINGS))
+    df_demographic = cache.load('demographic', demographic_key)
+    df_disease = cache.load('disease', disease_key)
+
+    # Start every input read a cache miss needs at once; each stage waits only for its own inputs
+    stale = df_demographic is None or df_disease is None
+    with prefetch_executor() as executor:
+        inputs = prefetch_inputs(executor, [MODEL_YEAR] if stale else [], [table_2_path] if stale else [])
+
+        if df_demographic is None:
+            df_demographic = process_code_1(model_year['rate_workbook'], table_2_path, output_path_code_1,
+                                            df_table_1=inputs[('demographic_table', MODEL_YEAR)].result(),
+                                            df_table_2=stage_members(inputs[('members', table_2_path)], DEMOGRAPHIC_MEMBER_COLUMNS))
+            cache.store('demographic', demographic_key, df_demographic)
+        else:
+            df_demographic.to_excel(output_path_code_1, index=False)
+
+        if df_disease is None:
+            df_disease = process_code_2(model_year['rate_workbook'], table_2_path, model_year['icd_to_hcc'], output_path_code_2,
+                                        df_table_1=inputs[('disease_table', MODEL_YEAR)].result(),
+                                        icd_to_hcc_dict=inputs[('icd_to_hcc_dict', MODEL_YEAR)].result(),
+                                        df_table_2=stage_members(inputs[('members', table_2_path)], DISEASE_MEMBER_COLUMNS))
+            cache.store('disease', disease_key, df_disease)
+        else:
+            df_disease.to_excel(output_path_code_2, index=False)
 
     # Display and sum target values
     display_and_sum_values(output_path_code_1, output_path_code_2)
+    cache.report()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
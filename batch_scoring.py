@@ -0,0 +1,358 @@
+import itertools
+from datetime import date, datetime
+from disease_factors import preprocess_icd_codes
+from model_years import AGE_BANDS, AGE_LABELS, RATE_COLUMNS, compiled_tables
+from lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Column-at-a-time versions of the demographic and disease stages. Every
+# function here reproduces the row-wise logic of process_code_1/process_code_2
+# (including its fallbacks) but works on whole columns and the compiled
+# coefficient arrays from model_years.
+
+MEMBER_COLUMNS = ['MemberID', 'DOB', 'Gender', 'Medicaid Dual Status', 'OREC', 'LTI', 'Diag_Code']
+ADJUSTMENT_COLUMNS = ['RAFT Code', 'Default Factor Code', 'Medicaid', 'Frailty Indicator', 'Medicaid Add on Factor']
+
+# RAFT code -> (LTI, Medicaid Dual Status, OREC) it forces; None keeps the
+# member's own value. Dual status uses a representative code of each group
+# (9 NonDual, 2 FBDual, 1 PBDual) and OREC 0 aged, 1 disabled. Besides the
+# CMS RAFT codes (CN, CF, CP, I, E, SE) the RAFT Code column may hold the score
+# segment labels some extracts write instead (CNA ... CPD, INS, NE, SNPNE);
+# both are accepted.
+RAFT_OVERRIDES = {
+    'I': ('Y', None, None), 'INS': ('Y', None, None),
+    'CN': ('N', 9, None), 'CF': ('N', 2, None), 'CP': ('N', 1, None),
+    'CNA': ('N', 9, 0), 'CND': ('N', 9, 1),
+    'CFA': ('N', 2, 0), 'CFD': ('N', 2, 1),
+    'CPA': ('N', 1, 0), 'CPD': ('N', 1, 1),
+}
+# New enrollees have no diagnosis year behind them and get the default (demographic only) score
+NEW_ENROLLEE_RAFT_CODES = ['E', 'SE', 'NE', 'SNPNE']
+
+INSTITUTIONAL = RATE_COLUMNS.index('Institutional')
+UNKNOWN_SEGMENT = -1
+NONE_OF_THE_ABOVE = len(AGE_LABELS) - 1
+
+_AGE_LOWER = [lower for lower, _, _ in AGE_BANDS]
+_AGE_UPPER = [upper for _, upper, _ in AGE_BANDS]
+
+def _tables(tables):
+    # Accept either a compiled table bundle or a model year
+    if isinstance(tables, dict):
+        return tables
+    return compiled_tables(tables)
+
+def standardize_dob_column(dob):
+    """
+    Vectorized standardize_dob: day-first strings, datetimes and dates (as
+    Parquet/Arrow date32 columns come out of to_pandas) become Timestamps,
+    anything else NaT.
+    """
+    dob = pd.Series(dob)
+    if pd.api.types.is_datetime64_any_dtype(dob):
+        return dob
+    kinds = dob.map(type)
+    text = dob.where(kinds == str).astype(object)
+    parsed = pd.to_datetime(text.str.replace('/', '-', regex=False), format='%d-%m-%Y', errors='coerce')
+    is_datetime = kinds.map(lambda kind: issubclass(kind, date)).astype(bool)
+    if is_datetime.any():
+        parsed[is_datetime] = pd.to_datetime(dob[is_datetime])
+    return parsed
+
+def calculate_age_matrix(dob, as_of_dates):
+    """Ages of every member on every as-of date as a (members x dates) float array. NaT gives NaN."""
+    dob = pd.to_datetime(pd.Series(dob))
+    birth_year = dob.dt.year.to_numpy(dtype=float)[:, None]
+    birth_month = dob.dt.month.to_numpy(dtype=float)[:, None]
+    birth_day = dob.dt.day.to_numpy(dtype=float)[:, None]
+    as_of = pd.DatetimeIndex(as_of_dates)
+    month, day = as_of.month.to_numpy()[None, :], as_of.day.to_numpy()[None, :]
+    before_birthday = (month < birth_month) | ((month == birth_month) & (day < birth_day))
+    return as_of.year.to_numpy()[None, :] - birth_year - before_birthday
+
+def calculate_age_column(dob, as_of=None):
+    """Vectorized calculate_age; ages are measured on `as_of` (default today). NaT gives NaN."""
+    as_of = pd.Timestamp(datetime.today() if as_of is None else as_of)
+    return calculate_age_matrix(dob, [as_of])[:, 0]
+
+def age_band_index(age):
+    """Index into AGE_LABELS for each age; NaN or out-of-range ages map to "None of the Above"."""
+    age = np.asarray(age, dtype=float)
+    band = np.searchsorted(np.array(_AGE_LOWER, dtype=float), age, side='right') - 1
+    valid = (band >= 0) & (age <= np.array(_AGE_UPPER, dtype=float)[band.clip(0)])
+    return np.where(valid, band, NONE_OF_THE_ABOVE).astype(np.int8)
+
+def gender_index(gender):
+    """Index into GENDER_LABELS: F -> Female, M -> Male, anything else -> None of the Above."""
+    gender = pd.Series(gender)
+    return np.select([gender == 'F', gender == 'M'], [0, 1], 2).astype(np.int8)
+
+def _dual_group(medicaid_dual_status):
+    # 0 NonDual, 1 FBDual, 2 PBDual (the order of RATE_COLUMNS), -1 Unknown
+    dual = pd.Series(medicaid_dual_status)
+    return np.select([dual.isin([1, 3, 5, 6]), dual.isin([2, 4, 8]), dual.isin([9])], [2, 1, 0], -1)
+
+def demographic_segment_index(LTI, medicaid_dual_status, OREC):
+    """
+    Rate column (index into RATE_COLUMNS) used by the demographic stage.
+
+    Institutional members use the Institutional column; community members with
+    an unknown dual status get UNKNOWN_SEGMENT. Any OREC other than 0 falls
+    through to the Disabled column, as in extract_target_value.
+    """
+    institutional = (pd.Series(LTI) == 'Y').to_numpy()
+    dual = _dual_group(medicaid_dual_status)
+    aged = pd.Series(OREC).isin([0]).to_numpy()
+    community = np.where(dual >= 0, 2 * dual + np.where(aged, 0, 1), UNKNOWN_SEGMENT)
+    return np.where(institutional, INSTITUTIONAL, community).astype(np.int8)
+
+def disease_segment_index(LTI, medicaid_dual_status, OREC):
+    """
+    Rate column (index into RATE_COLUMNS) used by the disease stage.
+
+    Unlike the demographic stage, an OREC other than 0 or 1 has no matching
+    column in extract_target_values, so those members get UNKNOWN_SEGMENT.
+    """
+    institutional = (pd.Series(LTI) == 'Y').to_numpy()
+    dual = _dual_group(medicaid_dual_status)
+    orec = pd.Series(OREC)
+    aged = orec.isin([0]).to_numpy()
+    disabled = orec.isin([1]).to_numpy()
+    community = np.where((dual >= 0) & (aged | disabled), 2 * dual + np.where(aged, 0, 1), UNKNOWN_SEGMENT)
+    return np.where(institutional, INSTITUTIONAL, community).astype(np.int8)
+
+def _flag(column):
+    # 1/Y/Yes/True -> True, anything else (including blanks) -> False
+    text = pd.Series(column).astype(object).where(pd.Series(column).notna(), '').astype(str).str.strip().str.upper()
+    return text.isin(['1', '1.0', 'Y', 'YES', 'TRUE']).to_numpy()
+
+def _raft_codes(raft_code):
+    raft = pd.Series(raft_code)
+    return raft.where(raft.notna(), '').astype(str).str.strip().str.upper()
+
+def apply_raft_codes(raft_code, LTI, medicaid_dual_status, OREC):
+    """
+    Eligibility columns after RAFT-driven segment overrides.
+
+    Members whose RAFT code is in RAFT_OVERRIDES take the LTI, dual status
+    and OREC that code stands for; blank or other codes keep their own values.
+    Returns (LTI, medicaid_dual_status, OREC) as Series for the segment functions.
+    """
+    raft = _raft_codes(raft_code)
+    columns = [pd.Series(column).reset_index(drop=True) for column in (LTI, medicaid_dual_status, OREC)]
+    for i in range(len(columns)):
+        override = raft.map({code: values[i] for code, values in RAFT_OVERRIDES.items() if values[i] is not None})
+        columns[i] = columns[i].astype(object).where(override.isna().to_numpy(), override.to_numpy())
+    return tuple(columns)
+
+def member_adjustments(members, tables):
+    """
+    Per-member adjustments from the ADJUSTMENT_COLUMNS.
+
+    Returns a dict with 'default_factor' (True for new enrollees: a RAFT code
+    in NEW_ENROLLEE_RAFT_CODES or a set Default Factor Code; their disease
+    component is dropped) and 'add_on' (the model year's frailty factor for
+    members with the Frailty Indicator set, plus the Medicaid Add on Factor
+    for members with Medicaid set). Raises ValueError when members have the
+    Frailty Indicator set and the model year has no frailty factor.
+    """
+    tables = _tables(tables)
+    default_factor = _raft_codes(members['RAFT Code']).isin(NEW_ENROLLEE_RAFT_CODES).to_numpy() | _flag(members['Default Factor Code'])
+    medicaid_add_on = pd.to_numeric(members['Medicaid Add on Factor'], errors='coerce').fillna(0.0).to_numpy(dtype=float)
+    frail = _flag(members['Frailty Indicator'])
+    frailty_factor = tables.get('frailty_factor')
+    if frailty_factor is None:
+        if frail.any():
+            raise ValueError(f"{int(frail.sum())} members have the Frailty Indicator set but model year {tables['model_year']} "
+                             f"has no frailty_factor; register one (model_years.register_model_year, or the model_years config of hcc_score.py)")
+        frailty_factor = 0.0
+    add_on = np.where(frail, frailty_factor, 0.0) + np.where(_flag(members['Medicaid']), medicaid_add_on, 0.0)
+    return {'default_factor': default_factor, 'add_on': add_on}
+
+def demographic_scores(gender, age_band, segment, tables):
+    """Demographic target value per member; NaN where the row-wise lookup returns None."""
+    coefficients = _tables(tables)['demographic_coefficients']
+    values = coefficients[gender, age_band, np.asarray(segment).clip(0)]
+    return np.where(np.asarray(segment) >= 0, values, np.nan)
+
+def flatten_diag_codes(diag_codes):
+    """
+    Flatten a Diag_Code column into parallel (member position, ICD code) arrays.
+
+    Cells may be stringified lists (parsed with preprocess_icd_codes) or
+    already list-like.
+    """
+    lists = [codes if isinstance(codes, (list, tuple, np.ndarray)) else preprocess_icd_codes(codes)
+             for codes in diag_codes]
+    lengths = np.fromiter(map(len, lists), dtype=np.int64, count=len(lists))
+    member_pos = np.repeat(np.arange(len(lists), dtype=np.int64), lengths)
+    codes = np.fromiter(itertools.chain.from_iterable(lists), dtype=object, count=int(lengths.sum()))
+    return member_pos, codes
+
+def _sorted_positions(sorted_codes, codes):
+    # Binary search in a sorted fixed-width bytes array (shared tables)
+    if len(sorted_codes) == 0 or len(codes) == 0:
+        return np.full(len(codes), -1, dtype=np.int64)
+    is_text = np.fromiter((isinstance(code, str) for code in codes), dtype=bool, count=len(codes))
+    query = np.array([code.encode('utf-8') if text else b'' for code, text in zip(codes, is_text)], dtype=bytes)
+    pos = np.searchsorted(sorted_codes, query).clip(max=len(sorted_codes) - 1)
+    return np.where(is_text & (sorted_codes[pos] == query), pos, -1)
+
+def icd_positions(codes, tables):
+    """Row of each ICD code in the compiled ICD lookup arrays, or -1 when unmapped."""
+    tables = _tables(tables)
+    if tables.get('icd_sorted'):
+        return _sorted_positions(tables['icd_codes'], codes)
+    if 'icd_index' not in tables:
+        tables['icd_index'] = pd.Index(tables['icd_codes'])
+    return tables['icd_index'].get_indexer(np.asarray(codes, dtype=object))
+
+def disease_scores(n_members, member_pos, icd_pos, segment, tables):
+    """
+    Disease target value per member: the sum of the HCC coefficients for every
+    mapped diagnosis (repeats included), NaN if any of them is blank.
+    """
+    tables = _tables(tables)
+    mapped = icd_pos >= 0
+    member_pos = member_pos[mapped]
+    hcc = tables['icd_hcc_index'][icd_pos[mapped]]
+    member_segment = np.asarray(segment)[member_pos]
+    keep = (hcc >= 0) & (member_segment >= 0)
+    weights = tables['hcc_coefficients'][hcc[keep], member_segment[keep]]
+    return np.bincount(member_pos[keep], weights=weights, minlength=n_members)
+
+def member_hcc_pairs(member_pos, icd_pos, tables):
+    """Distinct (member position, HCC row) pairs for diagnoses that map to an HCC with coefficients."""
+    tables = _tables(tables)
+    n_hcc = len(tables['hcc_labels'])
+    mapped = icd_pos >= 0
+    hcc = tables['icd_hcc_index'][icd_pos[mapped]].astype(np.int64)
+    member_pos = np.asarray(member_pos, dtype=np.int64)[mapped]
+    keep = hcc >= 0
+    if n_hcc == 0 or not keep.any():
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    pair_codes = np.unique(member_pos[keep] * n_hcc + hcc[keep])
+    return pair_codes // n_hcc, pair_codes % n_hcc
+
+def _eligibility(members, adjustments):
+    # LTI, dual status and OREC the segments are built from
+    eligibility = (members['LTI'], members['Medicaid Dual Status'], members['OREC'])
+    if adjustments:
+        eligibility = apply_raft_codes(members['RAFT Code'], *eligibility)
+    return eligibility
+
+def score_members(members, tables, as_of=None, diagnoses=None, details=None, adjustments=False):
+    """
+    Score a member frame with both stages in one pass.
+
+    Parameters:
+    - members: DataFrame with the MEMBER_COLUMNS of the member workbook.
+    - tables: compiled tables from model_years.compiled_tables, or a model year.
+    - as_of: date ages are measured on (default today).
+    - diagnoses: optional (member position, ICD code) arrays; when omitted the
+      Diag_Code column is flattened.
+    - details: optional dict that receives the per-member integer codes
+      ('gender', 'age_band', 'segment', 'disease_segment', 'dual_group') and
+      the flat diagnosis arrays ('member_pos', 'icd_codes', 'icd_pos') for
+      later stages.
+    - adjustments: apply the ADJUSTMENT_COLUMNS in the same pass (RAFT
+      segment overrides, default factor for new enrollees, frailty and
+      Medicaid add-ons; see member_adjustments). The members frame must have
+      those columns.
+
+    Returns:
+    - DataFrame with the columns display_and_sum_values produces, plus
+      'Target Value_Add-on' when adjustments is set.
+    """
+    tables = _tables(tables)
+    n_members = len(members)
+    dob = standardize_dob_column(members['DOB'])
+    age = calculate_age_column(dob, as_of)
+
+    gender = gender_index(members['Gender'])
+    age_band = age_band_index(age)
+    eligibility = _eligibility(members, adjustments)
+    segment = demographic_segment_index(*eligibility)
+    demographic = demographic_scores(gender, age_band, segment, tables)
+
+    if diagnoses is None:
+        diagnoses = flatten_diag_codes(members['Diag_Code'])
+    member_pos, codes = diagnoses
+    icd_pos = icd_positions(codes, tables)
+    disease_segment = disease_segment_index(*eligibility)
+    disease = disease_scores(n_members, member_pos, icd_pos, disease_segment, tables)
+    if adjustments:
+        adjustment = member_adjustments(members, tables)
+        disease = np.where(adjustment['default_factor'], 0.0, disease)
+
+    if details is not None:
+        details.update({
+            'gender': gender, 'age_band': age_band, 'segment': segment, 'disease_segment': disease_segment,
+            'dual_group': _dual_group(eligibility[1]).astype(np.int8),
+            'member_pos': member_pos, 'icd_codes': codes, 'icd_pos': icd_pos,
+        })
+
+    df_scores = pd.DataFrame({
+        'MemberID': members['MemberID'].to_numpy(),
+        'Age': age,
+        'Target Value_Demographic': np.nan_to_num(demographic, nan=0.0),
+        'Target Value_Disease': np.nan_to_num(disease, nan=0.0),
+    })
+    df_scores['Raw Risk Score'] = df_scores['Target Value_Demographic'] + df_scores['Target Value_Disease']
+    if adjustments:
+        df_scores.insert(4, 'Target Value_Add-on', adjustment['add_on'])
+        df_scores['Raw Risk Score'] += df_scores['Target Value_Add-on']
+    df_scores['Adjusted Risk Score'] = (df_scores['Raw Risk Score'] / tables['normalization_factor']) * (1 - tables['ma_coding_pattern'])
+    df_scores['Weighted Risk Score'] = df_scores['Adjusted Risk Score'] * tables['blend_weight']
+    return df_scores
+
+PERIOD_SCORE_COLUMNS = ['Raw Risk Score', 'Adjusted Risk Score', 'Weighted Risk Score']
+
+def score_periods(members, tables, as_of_dates, diagnoses=None, score_column='Adjusted Risk Score', adjustments=False):
+    """
+    Score members as of several dates in one pass.
+
+    Ages and age bands are recomputed for every date as one (members x dates)
+    array. Segments, HCC extraction and the disease component do not depend on
+    the date and are computed once.
+
+    Parameters:
+    - members, tables, diagnoses, adjustments: as for score_members.
+    - as_of_dates: the dates to score on.
+    - score_column: one of PERIOD_SCORE_COLUMNS.
+
+    Returns:
+    - DataFrame with MemberID and one column per as-of date (ISO date labels).
+    """
+    if score_column not in PERIOD_SCORE_COLUMNS:
+        raise ValueError(f"score_column must be one of {PERIOD_SCORE_COLUMNS}, not {score_column!r}")
+    tables = _tables(tables)
+    as_of_dates = pd.DatetimeIndex(as_of_dates)
+    n_members = len(members)
+
+    gender = gender_index(members['Gender'])
+    eligibility = _eligibility(members, adjustments)
+    segment = demographic_segment_index(*eligibility)
+    if diagnoses is None:
+        diagnoses = flatten_diag_codes(members['Diag_Code'])
+    member_pos, codes = diagnoses
+    disease = disease_scores(n_members, member_pos, icd_positions(codes, tables), disease_segment_index(*eligibility), tables)
+    disease = np.nan_to_num(disease, nan=0.0)
+    if adjustments:
+        adjustment = member_adjustments(members, tables)
+        disease = np.where(adjustment['default_factor'], 0.0, disease) + adjustment['add_on']
+
+    age = calculate_age_matrix(standardize_dob_column(members['DOB']), as_of_dates)
+    demographic = demographic_scores(gender[:, None], age_band_index(age), segment[:, None], tables)
+
+    scores = np.nan_to_num(demographic, nan=0.0) + disease[:, None]
+    if score_column != 'Raw Risk Score':
+        scores = (scores / tables['normalization_factor']) * (1 - tables['ma_coding_pattern'])
+    if score_column == 'Weighted Risk Score':
+        scores = scores * tables['blend_weight']
+
+    df_periods = pd.DataFrame(scores, columns=[date.date().isoformat() for date in as_of_dates])
+    df_periods.insert(0, 'MemberID', members['MemberID'].to_numpy())
+    return df_periods
@@ -0,0 +1,99 @@
+import os
+from lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Reads raw claim-line files (one row per member, ICD code and date of
+# service) straight into the (member position, ICD code) arrays the batch
+# engine scores, instead of collapsing claims into a stringified Diag_Code
+# list per member and parsing it back. Claims are streamed in chunks,
+# filtered to the service window and de-duplicated per (member, code).
+# MemberIDs are compared as strings on both sides, so zero-padded IDs survive
+# and every chunk keys its pairs the same way.
+
+MEMBER_COLUMN = 'MemberID'
+CODE_COLUMN = 'ICD_Code'
+DATE_COLUMN = 'Service_Date'
+CHUNK_ROWS = 500000
+
+def iter_claim_chunks(file_path, columns, chunk_rows=CHUNK_ROWS):
+    """Yield a claim-line file (CSV, Parquet or Arrow IPC) as DataFrames of at most chunk_rows rows."""
+    extension = os.path.splitext(str(file_path))[1].lower()
+    if extension in ('.parquet', '.arrow', '.feather', '.ipc'):
+        from out_of_core import iter_member_batches
+        for batch in iter_member_batches(file_path, columns=columns, batch_rows=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(file_path, usecols=columns, chunksize=chunk_rows, dtype={columns[0]: str, columns[1]: str})
+
+def normalize_icd_codes(codes):
+    """Upper-case ICD codes and drop dots and surrounding spaces to match the CMS mapping (E11.9 -> E119)."""
+    return codes.astype(str).str.strip().str.upper().str.replace('.', '', regex=False)
+
+def ingest_claims(file_paths, service_start=None, service_end=None, member_column=MEMBER_COLUMN,
+                  code_column=CODE_COLUMN, date_column=DATE_COLUMN, chunk_rows=CHUNK_ROWS):
+    """
+    Stream claim-line files into unique (MemberID, ICD code) pairs.
+
+    Parameters:
+    - file_paths: one claim file or a list of them.
+    - service_start, service_end: inclusive date-of-service window; claims
+      outside it, or without a parseable date, are dropped when either is set.
+    - member_column, code_column, date_column: column names in the claim files.
+    - chunk_rows: rows read per chunk.
+
+    Returns:
+    - DataFrame with 'MemberID' (as str) and 'ICD Code', one row per distinct pair.
+    """
+    if isinstance(file_paths, (str, os.PathLike)):
+        file_paths = [file_paths]
+    start = pd.Timestamp(service_start) if service_start is not None else None
+    end = pd.Timestamp(service_end) if service_end is not None else None
+    columns = [member_column, code_column] + ([date_column] if start is not None or end is not None else [])
+
+    chunk_pairs = []
+    n_lines = n_kept = 0
+    for file_path in file_paths:
+        for chunk in iter_claim_chunks(file_path, columns, chunk_rows):
+            n_lines += len(chunk)
+            chunk = chunk[chunk[member_column].notna() & chunk[code_column].notna()]
+            if start is not None or end is not None:
+                service_date = pd.to_datetime(chunk[date_column], errors='coerce')
+                in_window = service_date.notna()
+                if start is not None:
+                    in_window &= service_date >= start
+                if end is not None:
+                    in_window &= service_date <= end
+                chunk = chunk[in_window]
+            n_kept += len(chunk)
+            pairs = pd.DataFrame({'MemberID': chunk[member_column].astype(str).to_numpy(),
+                                  'ICD Code': normalize_icd_codes(chunk[code_column]).to_numpy()})
+            # Hash-based dedupe inside the chunk keeps the pairs held between chunks small
+            chunk_pairs.append(pairs.drop_duplicates())
+
+    if chunk_pairs:
+        claim_pairs = pd.concat(chunk_pairs, ignore_index=True).drop_duplicates(ignore_index=True)
+    else:
+        claim_pairs = pd.DataFrame({'MemberID': [], 'ICD Code': []})
+    print(f"Ingested {n_lines} claim lines ({n_kept} in the service window) into {len(claim_pairs)} unique member diagnoses")
+    return claim_pairs
+
+def claim_diagnoses(member_ids, claim_pairs):
+    """
+    Align claim pairs to a member frame for batch_scoring.score_members.
+
+    Returns (member position, ICD code) arrays; claims for members that are
+    not in member_ids are dropped. MemberIDs are matched as strings and must
+    be unique.
+    """
+    member_index = pd.Index(pd.Series(member_ids).astype(str))
+    if member_index.has_duplicates:
+        duplicated = member_index[member_index.duplicated()].unique()
+        raise ValueError(f"MemberIDs must be unique to attach claims; duplicated: {list(duplicated[:5])} "
+                         f"(drop them from the member file, or score with drop_invalid)")
+    member_pos = member_index.get_indexer(claim_pairs['MemberID'].astype(str))
+    keep = member_pos >= 0
+    n_matched = len(np.unique(member_pos[keep]))
+    print(f"Claims found for {n_matched} of {len(member_index)} members")
+    return member_pos[keep].astype(np.int64), claim_pairs['ICD Code'].to_numpy(dtype=object)[keep]
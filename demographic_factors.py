@@ -1,9 +1,11 @@
-import pandas as pd
 import ast
 from datetime import datetime
+from lazy_imports import lazy_import
 
-def load_table_1(file_path):
-    df = pd.read_excel(file_path, sheet_name=0, header=0)
+pd = lazy_import('pandas')
+
+def load_table_1(file_path, header=0):
+    df = pd.read_excel(file_path, sheet_name=0, header=header)
     df.columns = ['Variable', 'Description Label', 'Community, NonDual, Aged', 'Community, NonDual, Disabled',
                   'Community, FBDual, Aged', 'Community, FBDual, Disabled', 'Community, PBDual, Aged',
                   'Community, PBDual, Disabled', 'Institutional']
@@ -128,9 +130,11 @@ def extract_target_value(member_id, patient_category, df):
                 return age_row['Community, NonDual, Disabled'].values[0]
     return None
 
-def process_code_1(table_1_path, table_2_path, output_path):
-    df_table_1 = load_table_1(table_1_path)
-    df_table_2 = load_table_2(table_2_path)
+def process_code_1(table_1_path, table_2_path, output_path, df_table_1=None, df_table_2=None):
+    if df_table_1 is None:
+        df_table_1 = load_table_1(table_1_path)
+    if df_table_2 is None:
+        df_table_2 = load_table_2(table_2_path)
     
     print("Table 1 DataFrame:")
     print(df_table_1.head())
@@ -145,6 +149,7 @@ def process_code_1(table_1_path, table_2_path, output_path):
     
     df_table_2.to_excel(output_path, index=False)
     print(f"Data has been saved to {output_path}")
+    return df_table_2
 
 
 def main():
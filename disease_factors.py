@@ -1,9 +1,11 @@
-import pandas as pd
 import ast
 import datetime
+from lazy_imports import lazy_import
 
-def load_table_1(file_path):
-    df = pd.read_excel(file_path, sheet_name=0, header=1)
+pd = lazy_import('pandas')
+
+def load_table_1(file_path, header=1):
+    df = pd.read_excel(file_path, sheet_name=0, header=header)
     df.columns = ['Variable', 'Description Label', 'Community, NonDual, Aged', 'Community, NonDual, Disabled',
                   'Community, FBDual, Aged', 'Community, FBDual, Disabled', 'Community, PBDual, Aged',
                   'Community, PBDual, Disabled', 'Institutional']
@@ -73,19 +75,23 @@ def extract_target_values(hcc_codes, patient_category, df):
                             target_value += hcc_row[column].values[0]
     return target_value
 
-def process_code_2(table_1_path, table_2_path, icd_to_hcc_path, output_path):
-    df_table_1 = load_table_1(table_1_path)
+def process_code_2(table_1_path, table_2_path, icd_to_hcc_path, output_path, df_table_1=None, icd_to_hcc_dict=None, df_table_2=None):
+    if df_table_1 is None:
+        df_table_1 = load_table_1(table_1_path)
     print("Table 1 Columns:")
     print(df_table_1.columns)
     print("Number of Columns in Table 1:", len(df_table_1.columns))
     
-    df_table_2 = load_table_2(table_2_path)
-    df_icd_to_hcc = pd.read_csv(icd_to_hcc_path, header=None)
-    icd_to_hcc_dict = dict(zip(df_icd_to_hcc.iloc[:, 0], df_icd_to_hcc.iloc[:, 3]))
+    if df_table_2 is None:
+        df_table_2 = load_table_2(table_2_path)
+    if icd_to_hcc_dict is None:
+        df_icd_to_hcc = pd.read_csv(icd_to_hcc_path, header=None)
+        icd_to_hcc_dict = dict(zip(df_icd_to_hcc.iloc[:, 0], df_icd_to_hcc.iloc[:, 3]))
     
     df_table_2['HCC Codes'] = df_table_2['Diag_Code'].apply(lambda x: extract_hcc_codes(x, icd_to_hcc_dict))
     df_table_2['Patient Category'] = df_table_2.apply(lambda x: map_patient_data(x['LTI'], x['Medicaid Dual Status'], x['OREC']), axis=1)
     df_table_2['Target Value'] = df_table_2.apply(lambda x: extract_target_values(x['HCC Codes'], x['Patient Category'], df_table_1), axis=1)
     df_table_2.to_excel(output_path, index=False)
     print(f"Data has been saved to {output_path}")
+    return df_table_2
 
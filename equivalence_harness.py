@@ -0,0 +1,273 @@
+import argparse
+import contextlib
+import importlib
+import io
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+import batch_scoring
+import demographic_factors
+import disease_factors
+from model_years import (AGE_LABELS, GENDER_LABELS, RATE_COLUMNS, compiled_tables, demographic_table, disease_table,
+                         icd_to_hcc_dict, register_model_year)
+from patient_disease_information import calculate_adjusted_risk_score
+from prefetch import DEMOGRAPHIC_MEMBER_COLUMNS, DISEASE_MEMBER_COLUMNS
+from lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Differential check of the batch engine against the original row-wise
+# functions. Both paths run the same stage on the same members; results are
+# diffed member by member and each stage reports its measured speedup. The
+# last stage runs the whole per-year script (both stages and
+# display_and_sum_values) against score_members, the output every CLI writes.
+
+DEFAULT_TOLERANCE = 1e-9
+END_TO_END_COLUMNS = ['Age', 'Target Value_Demographic', 'Target Value_Disease', 'Raw Risk Score', 'Adjusted Risk Score',
+                      'Weighted Risk Score']
+
+def synthetic_members(n_members, model_year, seed=0):
+    """
+    Build a member frame in the member workbook layout, deliberately mixing in
+    the inputs the row-wise code has fallbacks for (bad dates, unknown codes,
+    malformed Diag_Code cells).
+    """
+    rng = np.random.default_rng(seed)
+    icd_codes = compiled_tables(model_year)['icd_codes']
+    known_codes = icd_codes if len(icd_codes) else np.array(['A000'], dtype=object)
+    today = datetime.today()
+
+    def random_dob():
+        kind = rng.random()
+        dob = today - timedelta(days=int(rng.integers(0, 105 * 365)))
+        if kind < 0.8:
+            return dob.strftime('%d/%m/%Y')
+        if kind < 0.9:
+            return dob
+        return None if kind < 0.95 else 'not a date'
+
+    def random_diag_codes():
+        if rng.random() < 0.03:
+            return 'malformed['
+        if rng.random() < 0.02:
+            return np.nan
+        codes = [str(rng.choice(known_codes)) if rng.random() < 0.9 else f"Z{rng.integers(0, 999):03d}X"
+                 for _ in range(int(rng.integers(0, 12)))]
+        return str(codes)
+
+    return pd.DataFrame({
+        'MemberID': [f"M{i:08d}" for i in range(n_members)],
+        'DOB': [random_dob() for _ in range(n_members)],
+        'Gender': rng.choice(['F', 'M', 'U'], n_members, p=[0.5, 0.48, 0.02]),
+        'Medicaid Dual Status': rng.choice([0, 1, 2, 3, 4, 5, 6, 8, 9, 10], n_members),
+        'OREC': rng.choice([0, 1, 2, 3], n_members, p=[0.6, 0.3, 0.05, 0.05]),
+        'LTI': rng.choice(['Y', 'N'], n_members, p=[0.05, 0.95]),
+        'Diag_Code': [random_diag_codes() for _ in range(n_members)],
+    })
+
+def _timed(function):
+    start = time.perf_counter()
+    # The row-wise functions print on every fallback; keep that off the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = function()
+    return result, time.perf_counter() - start
+
+def _legacy_segment(patient_category):
+    # The rate column extract_target_value picks for a demographic category
+    if 'Institutional' in patient_category:
+        return RATE_COLUMNS.index('Institutional')
+    for dual in ('PBDual', 'FBDual', 'NonDual'):
+        if dual in patient_category:
+            column = f"Community, {dual}, {'Aged' if 'Aged' in patient_category else 'Disabled'}"
+            return RATE_COLUMNS.index(column)
+    return batch_scoring.UNKNOWN_SEGMENT
+
+def _numeric(values):
+    return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype=float)
+
+def _mismatches(legacy, batch, tolerance):
+    # Element-wise mismatch mask; NaN on both sides counts as equal
+    legacy, batch = np.asarray(legacy), np.asarray(batch)
+    if legacy.dtype.kind == 'f' or batch.dtype.kind == 'f':
+        legacy, batch = legacy.astype(float), batch.astype(float)
+        both_nan = np.isnan(legacy) & np.isnan(batch)
+        close = np.abs(legacy - batch) <= tolerance
+        return ~(both_nan | close)
+    return legacy != batch
+
+def _stage_report(stage, member_ids, legacy, batch, legacy_seconds, batch_seconds, tolerance, max_diff=float('nan')):
+    mismatched = _mismatches(legacy, batch, tolerance)
+    if mismatched.ndim > 1:
+        mismatched = mismatched.any(axis=1)
+    return {
+        'Stage': stage,
+        'Members': len(member_ids),
+        'Mismatches': int(mismatched.sum()),
+        'Max Abs Diff': max_diff,
+        'Sample MemberIDs': list(np.asarray(member_ids)[mismatched][:5]),
+        'Legacy Seconds': legacy_seconds,
+        'Batch Seconds': batch_seconds,
+        'Speedup': legacy_seconds / batch_seconds if batch_seconds > 0 else np.inf,
+    }
+
+def _max_abs_diff(legacy, batch):
+    diff = np.abs(np.asarray(legacy, dtype=float) - np.asarray(batch, dtype=float))
+    diff = diff[~np.isnan(diff)]
+    return float(diff.max()) if len(diff) else 0.0
+
+def legacy_pipeline(members, model_year, work_dir):
+    """
+    Run the per-year script end to end: process_code_1, process_code_2 and
+    display_and_sum_values, with their Excel files in work_dir.
+
+    Returns:
+    - The combined frame display_and_sum_values writes, or None when the
+      model year has no script (only 2020 and 2024 do).
+    """
+    try:
+        script = importlib.import_module(f"{model_year}_weighted_risk_score")
+    except ModuleNotFoundError:
+        return None
+    demographic_path, disease_path, combined_path = (os.path.join(work_dir, name) for name in
+                                                     ('demographic.xlsx', 'disease.xlsx', 'combined.xlsx'))
+    script.process_code_1(None, None, demographic_path, df_table_1=demographic_table(model_year),
+                          df_table_2=members[[column for column in DEMOGRAPHIC_MEMBER_COLUMNS if column in members]].copy())
+    disease_factors.process_code_2(None, None, None, disease_path, df_table_1=disease_table(model_year),
+                                   icd_to_hcc_dict=icd_to_hcc_dict(model_year), df_table_2=members[DISEASE_MEMBER_COLUMNS].copy())
+    return script.display_and_sum_values(demographic_path, disease_path, combined_path)
+
+def run_harness(members, model_year, tolerance=DEFAULT_TOLERANCE):
+    """
+    Run every stage through the row-wise functions and the batch engine.
+
+    Returns a DataFrame with one row per stage: mismatch count, max absolute
+    difference, sample mismatching MemberIDs, timings and speedup.
+    """
+    tables = compiled_tables(model_year)
+    df_demographic = demographic_table(model_year)
+    df_disease = disease_table(model_year)
+    icd_dict = icd_to_hcc_dict(model_year)
+    member_ids = members['MemberID'].to_numpy()
+    n_members = len(members)
+    reports = []
+
+    # map_patient_data (with the DOB/age preparation both paths need)
+    def legacy_categories():
+        dob = members['DOB'].apply(demographic_factors.standardize_dob)
+        age = dob.apply(demographic_factors.calculate_age)
+        categories = [demographic_factors.map_patient_data(lti, dual, orec, a, gender) for lti, dual, orec, a, gender
+                      in zip(members['LTI'], members['Medicaid Dual Status'], members['OREC'], age, members['Gender'])]
+        return age, categories
+
+    def batch_categories():
+        age = batch_scoring.calculate_age_column(batch_scoring.standardize_dob_column(members['DOB']))
+        return (age, batch_scoring.gender_index(members['Gender']), batch_scoring.age_band_index(age),
+                batch_scoring.demographic_segment_index(members['LTI'], members['Medicaid Dual Status'], members['OREC']))
+
+    (legacy_age, categories), legacy_seconds = _timed(legacy_categories)
+    (age, gender, age_band, segment), batch_seconds = _timed(batch_categories)
+    legacy_keys = np.array([f"{c.split(', ')[-1]}|{c.split(', ')[-2]}|{_legacy_segment(c)}" for c in categories], dtype=object)
+    batch_keys = np.array([f"{GENDER_LABELS[g]}|{AGE_LABELS[a]}|{s}" for g, a, s in zip(gender, age_band, segment)], dtype=object)
+    age_mismatch = _mismatches(_numeric(legacy_age), age, tolerance)
+    reports.append(_stage_report('map_patient_data', member_ids, legacy_keys, np.where(age_mismatch, None, batch_keys),
+                                 legacy_seconds, batch_seconds, tolerance))
+
+    # extract_target_value
+    legacy_demographic, legacy_seconds = _timed(lambda: _numeric(
+        [demographic_factors.extract_target_value(m, c, df_demographic) for m, c in zip(member_ids, categories)]))
+    batch_demographic, batch_seconds = _timed(lambda: batch_scoring.demographic_scores(gender, age_band, segment, tables))
+    reports.append(_stage_report('extract_target_value', member_ids, legacy_demographic, batch_demographic,
+                                 legacy_seconds, batch_seconds, tolerance, _max_abs_diff(legacy_demographic, batch_demographic)))
+
+    # extract_hcc_codes
+    legacy_hcc_codes, legacy_seconds = _timed(lambda: [disease_factors.extract_hcc_codes(codes, icd_dict) for codes in members['Diag_Code']])
+
+    def batch_hcc_codes():
+        member_pos, codes = batch_scoring.flatten_diag_codes(members['Diag_Code'])
+        return member_pos, batch_scoring.icd_positions(codes, tables)
+
+    (member_pos, icd_pos), batch_seconds = _timed(batch_hcc_codes)
+    mapped = icd_pos >= 0
+    batch_hcc_codes = [[] for _ in range(n_members)]
+    for pos, label in zip(member_pos[mapped], tables['icd_hcc_labels'][icd_pos[mapped]]):
+        batch_hcc_codes[pos].append(label.decode('utf-8') if isinstance(label, bytes) else label)
+    reports.append(_stage_report('extract_hcc_codes', member_ids,
+                                 np.array([str(codes) for codes in legacy_hcc_codes], dtype=object),
+                                 np.array([str(codes) for codes in batch_hcc_codes], dtype=object),
+                                 legacy_seconds, batch_seconds, tolerance))
+
+    # extract_target_values
+    def legacy_disease():
+        categories = [disease_factors.map_patient_data(lti, dual, orec) for lti, dual, orec
+                      in zip(members['LTI'], members['Medicaid Dual Status'], members['OREC'])]
+        return _numeric([disease_factors.extract_target_values(codes, c, df_disease) for codes, c in zip(legacy_hcc_codes, categories)])
+
+    def batch_disease():
+        disease_segment = batch_scoring.disease_segment_index(members['LTI'], members['Medicaid Dual Status'], members['OREC'])
+        return batch_scoring.disease_scores(n_members, member_pos, icd_pos, disease_segment, tables)
+
+    legacy_disease_values, legacy_seconds = _timed(legacy_disease)
+    batch_disease_values, batch_seconds = _timed(batch_disease)
+    reports.append(_stage_report('extract_target_values', member_ids, legacy_disease_values, batch_disease_values,
+                                 legacy_seconds, batch_seconds, tolerance, _max_abs_diff(legacy_disease_values, batch_disease_values)))
+
+    # calculate_adjusted_risk_score on the combined raw score
+    raw = np.nan_to_num(legacy_demographic) + np.nan_to_num(legacy_disease_values)
+    legacy_adjusted, legacy_seconds = _timed(lambda: pd.Series(raw).apply(
+        lambda x: calculate_adjusted_risk_score(x, tables['normalization_factor'], tables['ma_coding_pattern'])).to_numpy())
+    batch_raw = np.nan_to_num(batch_demographic) + np.nan_to_num(batch_disease_values)
+    batch_adjusted, batch_seconds = _timed(lambda: (batch_raw / tables['normalization_factor']) * (1 - tables['ma_coding_pattern']))
+    reports.append(_stage_report('calculate_adjusted_risk_score', member_ids, legacy_adjusted, batch_adjusted,
+                                 legacy_seconds, batch_seconds, tolerance, _max_abs_diff(legacy_adjusted, batch_adjusted)))
+
+    # End to end: the per-year script's combined output against score_members
+    with tempfile.TemporaryDirectory() as work_dir:
+        legacy_combined, legacy_seconds = _timed(lambda: legacy_pipeline(members, model_year, work_dir))
+    if legacy_combined is not None:
+        batch_combined, batch_seconds = _timed(lambda: batch_scoring.score_members(members, tables))
+        legacy_values = legacy_combined.set_index('MemberID').reindex(member_ids)[END_TO_END_COLUMNS].to_numpy(dtype=float)
+        batch_values = batch_combined[END_TO_END_COLUMNS].to_numpy(dtype=float)
+        reports.append(_stage_report('display_and_sum_values', member_ids, legacy_values, batch_values,
+                                     legacy_seconds, batch_seconds, tolerance, _max_abs_diff(legacy_values, batch_values)))
+
+    return pd.DataFrame(reports)
+
+def load_members(file_path):
+    """Read a member file (Excel, Parquet or Arrow IPC)."""
+    if str(file_path).lower().endswith('.parquet'):
+        return pd.read_parquet(file_path)
+    if str(file_path).lower().endswith(('.arrow', '.feather', '.ipc')):
+        return pd.read_feather(file_path)
+    return pd.read_excel(file_path, usecols=batch_scoring.MEMBER_COLUMNS)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Diff the batch engine against the row-wise functions and time both.")
+    parser.add_argument('--model-year', type=int, default=2024)
+    parser.add_argument('--rate-workbook', help="rate workbook to use instead of the registered one")
+    parser.add_argument('--icd-to-hcc', help="ICD to HCC mapping CSV to use instead of the registered one")
+    parser.add_argument('--members', help="member file to use instead of synthetic members")
+    parser.add_argument('--n-members', type=int, default=10000, help="size of the synthetic population")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    overrides = {key: value for key, value in (('rate_workbook', args.rate_workbook), ('icd_to_hcc', args.icd_to_hcc)) if value}
+    if overrides:
+        register_model_year(args.model_year, **overrides)
+    if args.members:
+        members = load_members(args.members)
+    else:
+        members = synthetic_members(args.n_members, args.model_year, seed=args.seed)
+    report = run_harness(members, args.model_year, tolerance=args.tolerance)
+
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(report)
+    mismatches = int(report['Mismatches'].sum())
+    print("All stages match." if mismatches == 0 else f"{mismatches} mismatching member results.")
+    return 0 if mismatches == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
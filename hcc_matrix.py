@@ -0,0 +1,61 @@
+from batch_scoring import _tables, member_hcc_pairs
+from lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+
+# Member x HCC indicator matrices for downstream modelling. The matrix is
+# built from the (member, HCC) pairs the scoring pass already has and saved
+# in compressed sparse row form with its row (MemberID) and column (HCC)
+# labels, so it loads without parsing the stringified "HCC Codes" lists of
+# the Excel output. The file layout is the one scipy.sparse.save_npz writes,
+# so scipy.sparse.load_npz can read it too; scipy is not needed otherwise.
+
+def member_hcc_matrix(member_ids, member_pos, icd_pos, tables):
+    """
+    Build the member x HCC indicator matrix of one model year.
+
+    Parameters:
+    - member_ids: MemberID of every scored row (the matrix rows, in order).
+    - member_pos, icd_pos: the flat diagnosis arrays score_members puts in
+      its details dict.
+    - tables: compiled tables (or model year) the diagnoses were mapped with.
+
+    Returns:
+    - Dict with the CSR parts ('indptr', 'indices', 'data', 'shape') and the
+      labels ('member_ids', 'hcc_labels', 'model_year').
+    """
+    tables = _tables(tables)
+    n_members = len(member_ids)
+    hcc_labels = [label.decode('utf-8') if isinstance(label, bytes) else label for label in tables['hcc_labels']]
+    # Pairs come back unique and sorted by member, then HCC, which is CSR order
+    rows, columns = member_hcc_pairs(member_pos, icd_pos, tables)
+    indptr = np.zeros(n_members + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_members), out=indptr[1:])
+    return {
+        'indptr': indptr,
+        'indices': columns.astype(np.int32),
+        'data': np.ones(len(columns), dtype=np.uint8),
+        'shape': np.array([n_members, len(hcc_labels)], dtype=np.int64),
+        'member_ids': np.asarray(member_ids).astype(str),
+        'hcc_labels': np.array(hcc_labels, dtype=str),
+        'model_year': np.array(tables['model_year']),
+    }
+
+def save_hcc_matrix(output_path, matrix):
+    """Write a member_hcc_matrix dict as a compressed .npz file."""
+    np.savez_compressed(output_path, format=np.array('csr'), **matrix)
+
+def load_hcc_matrix(file_path, as_scipy=False):
+    """
+    Read a saved matrix back as the member_hcc_matrix dict.
+
+    With as_scipy the dict's 'matrix' entry also holds a
+    scipy.sparse.csr_matrix built from the parts (requires scipy).
+    """
+    with np.load(file_path, allow_pickle=False) as saved:
+        matrix = {key: saved[key] for key in saved.files if key != 'format'}
+    if as_scipy:
+        from scipy import sparse
+        matrix['matrix'] = sparse.csr_matrix((matrix['data'], matrix['indices'], matrix['indptr']),
+                                             shape=tuple(matrix['shape']))
+    return matrix
@@ -0,0 +1,304 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from lazy_imports import lazy_import
+
+pd = lazy_import('pandas')
+
+# Scores one or more member files for one or more model years in a single
+# invocation. Inputs, model years and output settings come from a JSON config
+# file (keys as in DEFAULT_CONFIG, described in the README) and/or the command
+# line, which wins. Rate tables are compiled once per model year and reused
+# for every input file.
+
+DEFAULT_CONFIG = {
+    'inputs': [],
+    'output_dir': '.',
+    'output_format': 'xlsx',
+    'score_years': [2020, 2024],
+    'as_of': None,
+    'as_of_dates': [],
+    'adjustments': False,
+    'validate': True,
+    'drop_invalid': False,
+    'hcc_matrix': False,
+    'reverse_index': False,
+    'claims': [],
+    'service_start': None,
+    'service_end': None,
+    'rollups': None,
+    'hcc_prevalence_by': ['Segment'],
+    'model_years': {},
+}
+OUTPUT_FORMATS = ['xlsx', 'csv', 'parquet']
+
+def load_config(config_path=None):
+    """Read a JSON config file on top of DEFAULT_CONFIG."""
+    config = dict(DEFAULT_CONFIG)
+    if config_path:
+        with open(config_path) as config_file:
+            config.update(json.load(config_file))
+    return config
+
+def expand_inputs(patterns):
+    """Expand glob patterns, keeping plain paths (even missing ones) so they are reported."""
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        paths.extend(matches if matches else [pattern])
+    return paths
+
+def read_members(file_path, with_diagnoses=True, extra_columns=()):
+    """Read a member file by extension: Excel, CSV, Parquet or Arrow IPC."""
+    from batch_scoring import MEMBER_COLUMNS
+    columns = [column for column in MEMBER_COLUMNS if with_diagnoses or column != 'Diag_Code'] + list(extra_columns)
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.parquet':
+        return pd.read_parquet(file_path, columns=columns)
+    if extension in ('.arrow', '.feather', '.ipc'):
+        return pd.read_feather(file_path, columns=columns)
+    if extension == '.csv':
+        return pd.read_csv(file_path, usecols=columns)
+    return pd.read_excel(file_path, usecols=columns)
+
+def _rollup_columns(rollups):
+    # Member columns the rollup dimensions need
+    if rollups is None:
+        return []
+    from rollups import member_dimensions
+    return member_dimensions(rollups.rollups, rollups.hcc_prevalence_by or ())
+
+def file_inputs(file_path, claim_pairs=None, extra_columns=(), adjustments=False, validation=None):
+    """
+    Read (and validate) a member file once for all scoring passes.
+
+    Returns (members, diagnoses): the member frame, without the failing rows
+    when validation['drop_invalid'] is set, and the claim diagnoses aligned
+    to it (None means the Diag_Code column). validation is as for score_file.
+    """
+    if adjustments:
+        from batch_scoring import ADJUSTMENT_COLUMNS
+        extra_columns = list(extra_columns) + [column for column in ADJUSTMENT_COLUMNS if column not in extra_columns]
+    members = read_members(file_path, with_diagnoses=claim_pairs is None, extra_columns=extra_columns)
+    if validation is not None:
+        from input_validation import validate_members
+        validation['report'], validation['quarantine'], valid = validate_members(members, validation.get('as_of'))
+        if validation.get('drop_invalid'):
+            members = members[valid].reset_index(drop=True)
+    diagnoses = None
+    if claim_pairs is not None:
+        from claim_ingestion import claim_diagnoses
+        diagnoses = claim_diagnoses(members['MemberID'], claim_pairs)
+    return members, diagnoses
+
+def score_file(file_path, score_years, as_of=None, claim_pairs=None, rollups=None, adjustments=False, validation=None,
+               hcc_matrices=None, reverse_indexes=None, inputs=None):
+    """
+    Score one member file for every requested model year.
+
+    Parameters:
+    - claim_pairs: diagnoses from claim_ingestion.ingest_claims, used instead
+      of the member file's Diag_Code column.
+    - rollups: a rollups.RollupAccumulator each year's scores are folded into.
+    - adjustments: apply the member file's ADJUSTMENT_COLUMNS.
+    - validation: dict that receives the 'report' and 'quarantine' frames of
+      input_validation.validate_members; ages are checked on its 'as_of'
+      date and failing rows are left out when its 'drop_invalid' key is set.
+    - hcc_matrices, reverse_indexes: dicts that receive each year's
+      member_hcc_matrix and build_reverse_index, keyed by year.
+    - inputs: (members, diagnoses) already read with file_inputs; the file
+      is not read (or validated) again.
+
+    Returns:
+    - Frame with MemberID, Age, the raw/adjusted/weighted score of each year
+      (suffixed with the year) and the Total Weighted Risk Score.
+    """
+    from batch_scoring import score_members
+    from model_years import compiled_tables
+    if inputs is None:
+        inputs = file_inputs(file_path, claim_pairs, _rollup_columns(rollups), adjustments, validation)
+    members, diagnoses = inputs
+    df_scores = None
+    for year in score_years:
+        details = {} if rollups is not None or hcc_matrices is not None or reverse_indexes is not None else None
+        df_year = score_members(members, year, as_of=as_of, diagnoses=diagnoses, details=details, adjustments=adjustments)
+        if rollups is not None:
+            rollups.add(df_year, details, compiled_tables(year), members=members)
+        if hcc_matrices is not None:
+            from hcc_matrix import member_hcc_matrix
+            hcc_matrices[year] = member_hcc_matrix(members['MemberID'], details['member_pos'], details['icd_pos'], year)
+        if reverse_indexes is not None:
+            from reverse_index import build_reverse_index
+            reverse_indexes[year] = build_reverse_index(details['member_pos'], details['icd_codes'], details['icd_pos'], year)
+        if df_scores is None:
+            df_scores = df_year[['MemberID', 'Age']].copy()
+            df_scores['Total Weighted Risk Score'] = 0.0
+        for column in ['Raw Risk Score', 'Adjusted Risk Score', 'Weighted Risk Score']:
+            df_scores[f"{column}_{year}"] = df_year[column].to_numpy()
+        df_scores['Total Weighted Risk Score'] += df_year['Weighted Risk Score'].to_numpy()
+    total = df_scores.pop('Total Weighted Risk Score')
+    df_scores['Total Weighted Risk Score'] = total
+    return df_scores
+
+def score_file_periods(file_path, score_years, as_of_dates, claim_pairs=None, adjustments=False, validation=None,
+                       inputs=None):
+    """
+    Total Weighted Risk Score of every member as of each date in as_of_dates,
+    summed over score_years. Returns MemberID plus one column per date.
+    validation and inputs are as for score_file.
+    """
+    from batch_scoring import flatten_diag_codes, score_periods
+    if inputs is None:
+        inputs = file_inputs(file_path, claim_pairs, adjustments=adjustments, validation=validation)
+    members, diagnoses = inputs
+    if diagnoses is None:
+        diagnoses = flatten_diag_codes(members['Diag_Code'])
+    df_periods = None
+    for year in score_years:
+        df_year = score_periods(members, year, as_of_dates, diagnoses=diagnoses, score_column='Weighted Risk Score',
+                                adjustments=adjustments)
+        if df_periods is None:
+            df_periods = df_year
+        else:
+            df_periods.iloc[:, 1:] += df_year.iloc[:, 1:].to_numpy()
+    return df_periods
+
+def output_path_for(input_path, output_dir, output_format, suffix='risk_scores'):
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(output_dir, f"{stem}_{suffix}.{output_format}")
+
+def write_scores(df_scores, output_path, output_format, raw=False):
+    # raw frames (quarantined member rows) can mix types within a column, e.g.
+    # date strings and datetimes in DOB; Parquet needs one type per column
+    if output_format == 'parquet':
+        if raw:
+            df_scores = df_scores.copy()
+            for column in df_scores.select_dtypes(include='object').columns:
+                df_scores[column] = df_scores[column].map(
+                    lambda value: None if value is None or isinstance(value, float) and value != value else str(value))
+        df_scores.to_parquet(output_path, index=False)
+    elif output_format == 'csv':
+        df_scores.to_csv(output_path, index=False)
+    else:
+        df_scores.to_excel(output_path, index=False)
+
+def score_input(input_path, config, score_years, claim_pairs=None):
+    """Score one input file and write all of its outputs as configured."""
+    start = time.perf_counter()
+    output_path = output_path_for(input_path, config['output_dir'], config['output_format'])
+    rollups = None
+    if config['rollups'] is not False:
+        from rollups import RollupAccumulator
+        rollups = RollupAccumulator(config['rollups'], config['hcc_prevalence_by'])
+    validation = {'as_of': config['as_of'], 'drop_invalid': config['drop_invalid']} if config['validate'] else None
+    hcc_matrices = {} if config['hcc_matrix'] else None
+    reverse_indexes = {} if config['reverse_index'] else None
+    # Read and validated once; the periods pass scores the same members
+    inputs = file_inputs(input_path, claim_pairs, _rollup_columns(rollups), config['adjustments'], validation)
+    df_scores = score_file(input_path, score_years, as_of=config['as_of'], rollups=rollups, adjustments=config['adjustments'],
+                           hcc_matrices=hcc_matrices, reverse_indexes=reverse_indexes, inputs=inputs)
+    # Scores first, so a failing side output never costs the scores
+    write_scores(df_scores, output_path, config['output_format'])
+    print(f"Scored {len(df_scores)} members from {input_path} in {time.perf_counter() - start:.2f}s; saved to {output_path}")
+    if validation is not None:
+        quality_path = output_path_for(input_path, config['output_dir'], config['output_format'], suffix='quality')
+        write_scores(validation['report'], quality_path, config['output_format'])
+        print(f"Quality report saved to {quality_path}")
+        if len(validation['quarantine']):
+            quarantine_path = output_path_for(input_path, config['output_dir'], config['output_format'], suffix='quarantine')
+            write_scores(validation['quarantine'], quarantine_path, config['output_format'], raw=True)
+            print(f"{len(validation['quarantine'])} quarantined rows saved to {quarantine_path}")
+    if rollups is not None:
+        summary_path = output_path_for(input_path, config['output_dir'], config['output_format'], suffix='summary')
+        write_scores(rollups.summary(), summary_path, config['output_format'])
+        print(f"Rollup summary saved to {summary_path}")
+    if hcc_matrices is not None:
+        from hcc_matrix import save_hcc_matrix
+        for year, matrix in hcc_matrices.items():
+            matrix_path = output_path_for(input_path, config['output_dir'], 'npz', suffix=f"hcc_{year}")
+            save_hcc_matrix(matrix_path, matrix)
+            print(f"Member x HCC matrix ({len(matrix['indices'])} member HCCs) saved to {matrix_path}")
+    if reverse_indexes is not None:
+        for year, index in reverse_indexes.items():
+            for name in ('hcc_codes', 'unmapped'):
+                index_path = output_path_for(input_path, config['output_dir'], config['output_format'], suffix=f"{name}_{year}")
+                write_scores(index[name], index_path, config['output_format'])
+            print(f"HCC reverse index for {year} saved ({len(index['hcc_codes'])} mapped and {len(index['unmapped'])} unmapped codes)")
+    if config['as_of_dates']:
+        periods_path = output_path_for(input_path, config['output_dir'], config['output_format'], suffix='periods')
+        df_periods = score_file_periods(input_path, score_years, config['as_of_dates'], adjustments=config['adjustments'],
+                                        inputs=inputs)
+        write_scores(df_periods, periods_path, config['output_format'])
+        print(f"Scores as of {len(config['as_of_dates'])} dates saved to {periods_path}")
+
+def run(config):
+    """Score every input in the config. Returns the number of inputs that failed."""
+    from model_years import register_model_year
+    for year, settings in config['model_years'].items():
+        register_model_year(year, **settings)
+
+    score_years = [int(year) for year in config['score_years']]
+    os.makedirs(config['output_dir'], exist_ok=True)
+    claim_pairs = None
+    if config['claims']:
+        from claim_ingestion import ingest_claims
+        claim_pairs = ingest_claims(expand_inputs(config['claims']), config['service_start'], config['service_end'])
+    failures = 0
+    for input_path in expand_inputs(config['inputs']):
+        if not os.path.isfile(input_path):
+            print(f"File not found: {input_path}")
+            failures += 1
+            continue
+        # One bad input is reported and counted; the remaining inputs are still scored
+        try:
+            score_input(input_path, config, score_years, claim_pairs)
+        except Exception as error:
+            print(f"Failed to score {input_path}: {type(error).__name__}: {error}")
+            failures += 1
+    return failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score member files with the HCC risk adjustment model.")
+    parser.add_argument('inputs', nargs='*', help="member files or glob patterns (added to the config inputs)")
+    parser.add_argument('-c', '--config', help="JSON config file")
+    parser.add_argument('-y', '--model-year', type=int, action='append', dest='score_years',
+                        help="model year to score (repeatable; default from config)")
+    parser.add_argument('-o', '--output-dir')
+    parser.add_argument('-f', '--output-format', choices=OUTPUT_FORMATS)
+    parser.add_argument('--as-of', help="date ages are measured on (default today)")
+    parser.add_argument('--as-of-date', action='append', dest='as_of_dates',
+                        help="also score as of this date into a <name>_periods file (repeatable)")
+    parser.add_argument('--adjustments', action='store_true', default=None,
+                        help="apply RAFT code, default factor, frailty and Medicaid add-on columns")
+    parser.add_argument('--no-validate', action='store_false', default=None, dest='validate',
+                        help="skip the input validation pass")
+    parser.add_argument('--drop-invalid', action='store_true', default=None,
+                        help="leave rows that fail validation out of the scores")
+    parser.add_argument('--no-rollups', action='store_false', default=None, dest='rollups',
+                        help="skip the <name>_summary file of cohort rollups")
+    parser.add_argument('--hcc-matrix', action='store_true', default=None,
+                        help="also save each year's member x HCC indicator matrix as <name>_hcc_<year>.npz")
+    parser.add_argument('--reverse-index', action='store_true', default=None,
+                        help="also write the ICD codes behind each HCC and the unmapped codes of every year")
+    parser.add_argument('--claims', action='append', help="claim-line file or glob to take diagnoses from (repeatable)")
+    parser.add_argument('--service-start', help="first date of service to include from the claims")
+    parser.add_argument('--service-end', help="last date of service to include from the claims")
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    config['inputs'] = list(config['inputs']) + args.inputs
+    for key in ('score_years', 'output_dir', 'output_format', 'as_of', 'as_of_dates', 'adjustments', 'validate',
+                'drop_invalid', 'rollups', 'hcc_matrix', 'reverse_index', 'claims', 'service_start', 'service_end'):
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+    if not config['inputs']:
+        parser.error("no input files given")
+    if config['output_format'] not in OUTPUT_FORMATS:
+        parser.error(f"unknown output format {config['output_format']!r}")
+    return 1 if run(config) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+import argparse
+import collections
+import os
+import sys
+import tempfile
+import batch_scoring
+import disease_factors
+from equivalence_harness import synthetic_members
+from hcc_matrix import load_hcc_matrix, member_hcc_matrix, save_hcc_matrix
+from model_years import AGE_LABELS, GENDER_LABELS, compiled_tables, icd_to_hcc_dict, register_model_year
+from reverse_index import build_reverse_index
+from lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Regression checks for the per-member indexes built from the flat diagnosis
+# arrays of a scoring pass. Each index is recounted member by member with the
+# row-wise Diag_Code parsing of disease_factors and the two are compared.
+# Without --rate-workbook/--icd-to-hcc the checks build a small synthetic rate
+# workbook and ICD mapping, so they run on any machine.
+
+def write_synthetic_tables(work_dir, n_hccs=40, n_icd_codes=300, seed=0):
+    """
+    Write a rate workbook and an ICD -> HCC CSV in the CMS layouts.
+
+    Some ICD codes map to HCCs past n_hccs, which have no coefficient row.
+    Returns (rate workbook path, ICD mapping path).
+    """
+    rng = np.random.default_rng(seed)
+    header = ['Variable', 'Description Label'] + [f"Rate {i}" for i in range(7)]
+    # Demographic rows start under the first header row, disease rows under the second
+    rows = [header, header]
+    for gender in GENDER_LABELS:
+        rows.append([gender, ''] + [None] * 7)
+        rows.extend([age_label, gender] + list(np.round(rng.random(7), 3)) for age_label in AGE_LABELS[:-1])
+    rows.extend([f"HCC{hcc}", f"Condition {hcc}"] + list(np.round(rng.random(7), 3)) for hcc in range(1, n_hccs + 1))
+    rate_workbook = os.path.join(work_dir, 'rates.xlsx')
+    pd.DataFrame(rows).to_excel(rate_workbook, header=False, index=False)
+
+    icd_to_hcc = os.path.join(work_dir, 'icd_to_hcc.csv')
+    pd.DataFrame([[f"A{i:03d}", '', '', i % (n_hccs + 5) + 1] for i in range(n_icd_codes)]).to_csv(
+        icd_to_hcc, header=False, index=False)
+    return rate_workbook, icd_to_hcc
+
+def _legacy_codes(diag_codes):
+    # ICD codes of every member as the row-wise disease stage parses them
+    return [disease_factors.preprocess_icd_codes(codes) if isinstance(codes, str) else [] for codes in diag_codes]
+
+def check_hcc_matrix(members, model_year, work_dir):
+    """
+    Recount the member x HCC matrix member by member, after a save/load round trip.
+
+    Returns the number of members whose HCCs differ.
+    """
+    tables = compiled_tables(model_year)
+    details = {}
+    batch_scoring.score_members(members, tables, details=details)
+    matrix_path = os.path.join(work_dir, 'hcc_matrix.npz')
+    save_hcc_matrix(matrix_path, member_hcc_matrix(members['MemberID'], details['member_pos'], details['icd_pos'], tables))
+    matrix = load_hcc_matrix(matrix_path)
+
+    icd_dict = icd_to_hcc_dict(model_year)
+    with_coefficients = set(matrix['hcc_labels'])
+    mismatches = 0
+    for row, codes in enumerate(_legacy_codes(members['Diag_Code'])):
+        expected = {f"HCC{icd_dict[code]}" for code in codes if code in icd_dict} & with_coefficients
+        found = set(matrix['hcc_labels'][matrix['indices'][matrix['indptr'][row]:matrix['indptr'][row + 1]]])
+        mismatches += expected != found
+    same_ids = list(matrix['member_ids']) == [str(member_id) for member_id in members['MemberID']]
+    print(f"hcc_matrix: {mismatches} of {len(members)} members differ; member ids {'match' if same_ids else 'DIFFER'}")
+    return mismatches + (not same_ids)
+
+def check_reverse_index(members, model_year):
+    """
+    Recount the HCC reverse index (code counts, members per code and per HCC)
+    member by member.
+
+    Returns the number of index rows that differ.
+    """
+    tables = compiled_tables(model_year)
+    details = {}
+    batch_scoring.score_members(members, tables, details=details)
+    index = build_reverse_index(details['member_pos'], details['icd_codes'], details['icd_pos'], tables)
+
+    icd_dict = icd_to_hcc_dict(model_year)
+    code_count = collections.Counter()
+    code_members = collections.defaultdict(set)
+    hcc_members = collections.defaultdict(set)
+    for row, codes in enumerate(_legacy_codes(members['Diag_Code'])):
+        for code in codes:
+            code_count[code] += 1
+            code_members[code].add(row)
+            if code in icd_dict:
+                hcc_members[f"HCC{icd_dict[code]}"].add(row)
+    expected = {
+        'hcc_codes': {(f"HCC{icd_dict[code]}", code, count, len(code_members[code]), len(hcc_members[f"HCC{icd_dict[code]}"]))
+                      for code, count in code_count.items() if code in icd_dict},
+        'unmapped': {(code, count, len(code_members[code])) for code, count in code_count.items() if code not in icd_dict},
+    }
+    mismatches = 0
+    for name, rows in expected.items():
+        found = set(index[name].itertuples(index=False, name=None))
+        differing = len(rows ^ found)
+        print(f"reverse_index {name}: {len(found)} rows, {differing} differ from the recount")
+        mismatches += differing
+    return mismatches
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recount the HCC indexes of a scoring pass member by member.")
+    parser.add_argument('--model-year', type=int, default=2024)
+    parser.add_argument('--rate-workbook', help="rate workbook (default: a synthetic one)")
+    parser.add_argument('--icd-to-hcc', help="ICD to HCC mapping CSV (default: a synthetic one)")
+    parser.add_argument('--n-members', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        rate_workbook, icd_to_hcc = write_synthetic_tables(work_dir, seed=args.seed)
+        register_model_year(args.model_year, rate_workbook=args.rate_workbook or rate_workbook,
+                            icd_to_hcc=args.icd_to_hcc or icd_to_hcc)
+        members = synthetic_members(args.n_members, args.model_year, seed=args.seed)
+        failures = check_hcc_matrix(members, args.model_year, work_dir) + check_reverse_index(members, args.model_year)
+    print("All indexes match." if failures == 0 else f"{failures} mismatching results.")
+    return 0 if failures == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+import argparse
+import sys
+from batch_scoring import (_dual_group, age_band_index, calculate_age_column, flatten_diag_codes,
+                           NONE_OF_THE_ABOVE, standardize_dob_column)
+from lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Checks a whole member frame before scoring. Each rule is a boolean mask over
+# the rows, so bad inputs are counted and sampled in one pass instead of
+# surfacing row by row as NaT, "Unknown" or None and then as zeros after
+# fillna(0). Rows failing any rule can be written to a quarantine file.
+
+# Rule name -> description, in report order. Rules whose columns are not in
+# the member frame are skipped.
+VALIDATION_RULES = {
+    'member_id': "MemberID missing or duplicated",
+    'dob_unparseable': "DOB is not a date (day-first string or datetime)",
+    'age_out_of_range': "Age on the as-of date falls in no age band",
+    'gender': "Gender is not M or F",
+    'lti': "LTI is not Y or N",
+    'dual_status': "Medicaid Dual Status is not a known code (1-6, 8, 9)",
+    'orec': "OREC is not 0 (aged) or 1 (disabled)",
+    'diag_code_malformed': "Diag_Code is not a list of codes",
+    'icd_code_format': "Diag_Code holds a code that is not an ICD-10-CM code (e.g. E119)",
+}
+RULE_COLUMNS = {
+    'member_id': ['MemberID'],
+    'dob_unparseable': ['DOB'],
+    'age_out_of_range': ['DOB'],
+    'gender': ['Gender'],
+    'lti': ['LTI'],
+    'dual_status': ['Medicaid Dual Status'],
+    'orec': ['OREC'],
+    'diag_code_malformed': ['Diag_Code'],
+    'icd_code_format': ['Diag_Code'],
+}
+ICD_CODE_PATTERN = r'[A-Z][0-9][0-9A-Z]{1,5}'
+# A stringified list of quoted codes, as written to the member workbooks
+DIAG_LIST_PATTERN = r"""\[\s*(?:(?:'[^']*'|"[^"]*")(?:\s*,\s*(?:'[^']*'|"[^"]*"))*\s*,?)?\s*\]"""
+QUOTED_CODE_PATTERN = r"""['"]([^'"]*)['"]"""
+SAMPLE_SIZE = 5
+
+def _diag_code_masks(diag_codes):
+    # (malformed cell, cell holding a badly formatted code) per row
+    diag_codes = pd.Series(diag_codes).reset_index(drop=True)
+    is_list = diag_codes.map(lambda cell: isinstance(cell, (list, tuple, np.ndarray))).to_numpy(dtype=bool)
+    text = diag_codes.where(~is_list & diag_codes.notna().to_numpy())
+    blank = text.isna() | (text.astype(str).str.strip() == '')
+    well_formed = text.astype(str).str.strip().str.fullmatch(DIAG_LIST_PATTERN).fillna(False)
+    well_formed = well_formed.to_numpy(dtype=bool) & ~blank.to_numpy()
+    malformed = ~(is_list | blank.to_numpy() | well_formed)
+
+    # Codes of well-formed text cells are pulled out by regex rather than parsed cell by cell
+    found_pos, found_codes = flatten_diag_codes(text[well_formed].str.findall(QUOTED_CODE_PATTERN))
+    list_pos, list_codes = flatten_diag_codes(diag_codes[is_list])
+    member_pos = np.concatenate([np.flatnonzero(well_formed)[found_pos], np.flatnonzero(is_list)[list_pos]])
+    codes = pd.Series(np.concatenate([found_codes, list_codes]), dtype=object)
+    bad_code = ~codes.astype(str).str.fullmatch(ICD_CODE_PATTERN).to_numpy(dtype=bool)
+    bad_format = np.bincount(member_pos[bad_code], minlength=len(diag_codes)) > 0
+    return malformed, bad_format
+
+def validation_masks(members, as_of=None):
+    """
+    Evaluate every applicable rule on a member frame.
+
+    Returns a boolean DataFrame with one column per rule (True = the row fails
+    it), aligned with the rows of members.
+    """
+    masks = {}
+    available = [rule for rule, columns in RULE_COLUMNS.items() if all(column in members for column in columns)]
+    if 'member_id' in available:
+        member_id = members['MemberID']
+        masks['member_id'] = (member_id.isna() | member_id.duplicated(keep=False)).to_numpy()
+    if 'dob_unparseable' in available:
+        dob = standardize_dob_column(members['DOB'])
+        masks['dob_unparseable'] = dob.isna().to_numpy()
+        masks['age_out_of_range'] = dob.notna().to_numpy() & (age_band_index(calculate_age_column(dob, as_of)) == NONE_OF_THE_ABOVE)
+    if 'gender' in available:
+        masks['gender'] = ~members['Gender'].isin(['M', 'F']).to_numpy()
+    if 'lti' in available:
+        masks['lti'] = ~members['LTI'].isin(['Y', 'N']).to_numpy()
+    if 'dual_status' in available:
+        masks['dual_status'] = _dual_group(members['Medicaid Dual Status']) < 0
+    if 'orec' in available:
+        masks['orec'] = ~members['OREC'].isin([0, 1]).to_numpy()
+    if 'diag_code_malformed' in available:
+        masks['diag_code_malformed'], masks['icd_code_format'] = _diag_code_masks(members['Diag_Code'])
+    return pd.DataFrame({rule: np.asarray(masks[rule], dtype=bool) for rule in VALIDATION_RULES if rule in masks})
+
+def quality_report(members, masks, sample_size=SAMPLE_SIZE):
+    """Per-rule failing row count, share of rows and sample MemberIDs."""
+    member_ids = members['MemberID'].to_numpy() if 'MemberID' in members else np.arange(len(members))
+    rows = []
+    for rule in masks:
+        failing = masks[rule].to_numpy()
+        rows.append({
+            'Rule': rule,
+            'Description': VALIDATION_RULES[rule],
+            'Failing Rows': int(failing.sum()),
+            'Failing Share': float(failing.mean()) if len(failing) else 0.0,
+            'Sample MemberIDs': ', '.join(str(member_id) for member_id in member_ids[failing][:sample_size]),
+        })
+    return pd.DataFrame(rows, columns=['Rule', 'Description', 'Failing Rows', 'Failing Share', 'Sample MemberIDs'])
+
+def quarantine_rows(members, masks):
+    """The rows failing any rule, with a 'Validation Errors' column naming the rules they fail."""
+    failing = masks.any(axis=1).to_numpy()
+    errors = pd.Series('', index=np.flatnonzero(failing), dtype=object)
+    for rule in masks:
+        errors += np.where(masks[rule].to_numpy()[failing], rule + '; ', '')
+    quarantine = members[failing].copy()
+    quarantine['Validation Errors'] = errors.str[:-2].to_numpy()
+    return quarantine
+
+def validate_members(members, as_of=None):
+    """
+    Validate a member frame before scoring.
+
+    Returns:
+    - (report, quarantine, valid): the quality_report frame, the failing rows
+      with their errors, and a boolean array marking the rows that pass.
+    """
+    masks = validation_masks(members, as_of)
+    report = quality_report(members, masks)
+    quarantine = quarantine_rows(members, masks)
+    valid = ~masks.any(axis=1).to_numpy()
+    print(f"Validated {len(members)} members: {int((~valid).sum())} failing at least one rule")
+    for rule, description, failing, samples in zip(report['Rule'], report['Description'], report['Failing Rows'], report['Sample MemberIDs']):
+        if failing:
+            print(f"  {rule}: {failing} ({description}); e.g. {samples}")
+    return report, quarantine, valid
+
+def main(argv=None):
+    from hcc_score import read_members, write_scores
+    parser = argparse.ArgumentParser(description="Check a member file and write a quality report and quarantine file.")
+    parser.add_argument('members', help="member file (Excel, CSV, Parquet or Arrow IPC)")
+    parser.add_argument('--report', help="quality report output (.xlsx, .csv or .parquet)")
+    parser.add_argument('--quarantine', help="quarantine output (.xlsx, .csv or .parquet)")
+    parser.add_argument('--as-of', help="date ages are measured on (default today)")
+    args = parser.parse_args(argv)
+
+    members = read_members(args.members)
+    report, quarantine, valid = validate_members(members, args.as_of)
+    for output_path, df in ((args.report, report), (args.quarantine, quarantine)):
+        if output_path:
+            write_scores(df, output_path, output_path.rsplit('.', 1)[-1].lower(), raw=df is quarantine)
+            print(f"Saved {output_path}")
+    return 0 if valid.all() else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,29 @@
+import importlib
+import sys
+
+# pandas, numpy and pyarrow take a noticeable fraction of a second to import.
+# Modules bind them through lazy_import so that importing a module (or
+# starting the command line tool) does not pay for them until a function
+# actually uses them.
+
+class LazyModule:
+    """Stand-in for a module that is imported on first attribute access."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f"<lazy module '{self._name}' ({state})>"
+
+def lazy_import(name):
+    """Return the module if it is already imported, otherwise a LazyModule for it."""
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
@@ -0,0 +1,54 @@
+from lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Dictionary encoding of MemberIDs. The stage outputs are joined on MemberID,
+# which is a mixed-format object column in the member workbooks; hash-joining
+# it with pd.merge is slow and memory hungry on large files. Instead every
+# MemberID column of a join is encoded once against a shared dictionary into
+# dense int32 keys, the value columns are scattered into arrays indexed by
+# those keys, and the IDs are decoded from the dictionary only for output.
+
+def encode_member_ids(*id_columns, sort=True):
+    """
+    Encode MemberID columns against one shared dictionary.
+
+    Parameters:
+    - id_columns: MemberID columns (Series or arrays) of the frames to join.
+      Each column must hold every MemberID at most once.
+    - sort: order the dictionary like the keys of pd.merge's outer join.
+      Mixed types that cannot be compared keep first-seen order.
+
+    Returns:
+    - (list of int32 key arrays, one per column; the dictionary of MemberIDs).
+      Key k of any column stands for dictionary entry k.
+    """
+    columns = [pd.Series(column).reset_index(drop=True) for column in id_columns]
+    for column in columns:
+        duplicated = column[column.duplicated()]
+        if len(duplicated):
+            raise ValueError(f"MemberIDs must be unique to be joined; duplicated: {list(duplicated.unique()[:5])}")
+    values = pd.concat(columns, ignore_index=True) if columns else pd.Series([], dtype=object)
+    try:
+        codes, member_ids = pd.factorize(values, sort=sort, use_na_sentinel=False)
+    except TypeError:
+        codes, member_ids = pd.factorize(values, sort=False, use_na_sentinel=False)
+    codes = codes.astype(np.int32)
+    bounds = np.cumsum([0] + [len(column) for column in columns])
+    return [codes[start:end] for start, end in zip(bounds[:-1], bounds[1:])], np.asarray(member_ids)
+
+def scatter_by_key(keys, values, n_keys, fill_value=float('nan')):
+    """
+    Place values at their keys in a dense array of n_keys entries.
+
+    Keys that have no value get fill_value. When every key is covered the
+    values keep their dtype, as they would through a merge.
+    """
+    values = np.asarray(values)
+    if len(keys) == n_keys:
+        dense = np.empty(n_keys, dtype=values.dtype)
+    else:
+        dense = np.full(n_keys, fill_value, dtype=np.result_type(values.dtype, np.asarray(fill_value).dtype))
+    dense[keys] = values
+    return dense
@@ -0,0 +1,230 @@
+import functools
+import threading
+from lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Coefficient columns shared by every rate announcement workbook
+RATE_COLUMNS = ['Community, NonDual, Aged', 'Community, NonDual, Disabled',
+                'Community, FBDual, Aged', 'Community, FBDual, Disabled', 'Community, PBDual, Aged',
+                'Community, PBDual, Disabled', 'Institutional']
+TABLE_1_COLUMNS = ['Variable', 'Description Label'] + RATE_COLUMNS
+
+# Row and column labels of the compiled demographic coefficient array
+GENDER_LABELS = ['Female', 'Male', 'None of the Above']
+AGE_BANDS = [
+    (0, 34, "0-34 Years"),
+    (35, 44, "35-44 Years"),
+    (45, 54, "45-54 Years"),
+    (55, 59, "55-59 Years"),
+    (60, 64, "60-64 Years"),
+    (65, 69, "65-69 Years"),
+    (70, 74, "70-74 Years"),
+    (75, 79, "75-79 Years"),
+    (80, 84, "80-84 Years"),
+    (85, 89, "85-89 Years"),
+    (90, 94, "90-94 Years"),
+    (95, float('inf'), "95 Years or Over"),
+]
+AGE_LABELS = [label for _, _, label in AGE_BANDS] + ["None of the Above"]
+
+ICD_TO_HCC_2024_INITIAL = "C:/Users/Spencerdm/Downloads/2024 Initial ICD-10-CM Mappings/2024 Initial ICD-10-CM Mappings.csv"
+
+# Everything that differs between model years. The demographic and disease
+# factors live on the same sheet but start on different header rows. The
+# frailty factor has no shipped value; it must be registered before scoring
+# members with the Frailty Indicator set with adjustments on.
+MODEL_YEARS = {
+    2020: {
+        'rate_workbook': 'C:/Users/Spencerdm/OneDrive/Documents/ADT Project/Rate Announcement 2020.xlsx',
+        'rate_sheet': 0,
+        'demographic_header': 0,
+        'disease_header': 1,
+        'icd_to_hcc': ICD_TO_HCC_2024_INITIAL,
+        'icd_column': 0,
+        'hcc_column': 3,
+        'normalization_factor': 1.069,
+        'ma_coding_pattern': 5.9 / 100,
+        'blend_weight': 0.3,
+        'frailty_factor': None,
+    },
+    2024: {
+        'rate_workbook': 'C:/Users/Spencerdm/OneDrive/Documents/ADT Project/Rate Announcement 2024.xlsx',
+        'rate_sheet': 0,
+        'demographic_header': 0,
+        'disease_header': 1,
+        'icd_to_hcc': ICD_TO_HCC_2024_INITIAL,
+        'icd_column': 0,
+        'hcc_column': 3,
+        'normalization_factor': 1.015,
+        'ma_coding_pattern': 5.9 / 100,
+        'blend_weight': 0.7,
+        'frailty_factor': None,
+    },
+}
+
+# Registry settings each stage's output depends on (used to key cached stage outputs)
+DEMOGRAPHIC_SETTINGS = ['rate_workbook', 'rate_sheet', 'demographic_header']
+DISEASE_SETTINGS = ['rate_workbook', 'rate_sheet', 'disease_header', 'icd_to_hcc', 'icd_column', 'hcc_column']
+
+def get_model_year(year):
+    """Return the registry entry for a model year."""
+    try:
+        return MODEL_YEARS[int(year)]
+    except KeyError:
+        raise ValueError(f"Model year {year} is not registered (known years: {sorted(MODEL_YEARS)})")
+
+def stage_settings(year, keys):
+    """The subset of a model year's settings named in keys."""
+    settings = get_model_year(year)
+    return {key: settings[key] for key in keys}
+
+def register_model_year(year, **settings):
+    """
+    Add a model year or override settings of an existing one.
+
+    New years start from the most recent registered year, so only the
+    settings that actually change need to be given. Cached tables are
+    dropped because they may have been built from the old settings.
+    """
+    year = int(year)
+    base = MODEL_YEARS.get(year) or MODEL_YEARS[max(MODEL_YEARS)]
+    MODEL_YEARS[year] = {**base, **settings}
+    clear_cache()
+    return MODEL_YEARS[year]
+
+def clear_cache():
+    """Forget every loaded and compiled table."""
+    for loader in (_read_rate_workbook, demographic_table, disease_table, icd_to_hcc_dict,
+                   demographic_coefficients, hcc_coefficients, icd_lookup, compiled_tables):
+        loader.cache_clear()
+
+_year_locks = {}
+_year_locks_guard = threading.Lock()
+
+@functools.lru_cache(maxsize=None)
+def _read_rate_workbook(year):
+    # The workbook is read once without a header so both stages can slice
+    # their own table out of it.
+    settings = get_model_year(year)
+    return pd.read_excel(settings['rate_workbook'], sheet_name=settings['rate_sheet'], header=None)
+
+def _rate_workbook(year):
+    # Both stage tables may be requested from different threads at once
+    # (see prefetch.py); the per-year lock makes them share a single read.
+    with _year_locks_guard:
+        lock = _year_locks.setdefault(int(year), threading.Lock())
+    with lock:
+        return _read_rate_workbook(year)
+
+def _table_from_header(raw, header):
+    df = raw.iloc[header + 1:].reset_index(drop=True).infer_objects()
+    df.columns = TABLE_1_COLUMNS
+    return df
+
+@functools.lru_cache(maxsize=None)
+def demographic_table(year):
+    """Rate table as read by the demographic stage (same shape as load_table_1)."""
+    return _table_from_header(_rate_workbook(year), get_model_year(year)['demographic_header'])
+
+@functools.lru_cache(maxsize=None)
+def disease_table(year):
+    """Rate table as read by the disease stage (same shape as load_table_1)."""
+    return _table_from_header(_rate_workbook(year), get_model_year(year)['disease_header'])
+
+@functools.lru_cache(maxsize=None)
+def icd_to_hcc_dict(year):
+    """ICD-10 code -> HCC number mapping for a model year."""
+    settings = get_model_year(year)
+    df_icd_to_hcc = pd.read_csv(settings['icd_to_hcc'], header=None)
+    return dict(zip(df_icd_to_hcc.iloc[:, settings['icd_column']], df_icd_to_hcc.iloc[:, settings['hcc_column']]))
+
+def _demographic_row(df, gender, age_category):
+    # Same section search as extract_target_value: a gender block runs from
+    # its header row up to the row just before the other gender's header.
+    if gender not in df['Variable'].values:
+        return None
+    gender_section_start = df[df['Variable'] == gender].index[0]
+    next_gender_index = df[df['Variable'].shift(-1) == ('Male' if gender == 'Female' else 'Female')].index
+    gender_section_end = next_gender_index[0] if not next_gender_index.empty else len(df)
+    gender_section = df.iloc[gender_section_start:gender_section_end]
+    age_row = gender_section[gender_section['Variable'] == age_category]
+    if age_row.empty:
+        return None
+    return age_row.iloc[0]
+
+def compile_demographic_coefficients(df):
+    """
+    Compile a demographic rate table into a dense coefficient array.
+
+    Returns a float array indexed [gender, age band, segment] following
+    GENDER_LABELS, AGE_LABELS and RATE_COLUMNS. Combinations the row-wise
+    lookup cannot resolve are NaN.
+    """
+    coefficients = np.full((len(GENDER_LABELS), len(AGE_LABELS), len(RATE_COLUMNS)), np.nan)
+    for g, gender in enumerate(GENDER_LABELS):
+        for a, age_category in enumerate(AGE_LABELS):
+            row = _demographic_row(df, gender, age_category)
+            if row is not None:
+                coefficients[g, a] = pd.to_numeric(row[RATE_COLUMNS], errors='coerce').to_numpy(dtype=float)
+    return coefficients
+
+def compile_hcc_coefficients(df):
+    """
+    Compile a disease rate table into an HCC x segment coefficient matrix.
+
+    Returns a dict with 'labels' (HCC labels such as 'HCC18', first occurrence
+    wins like the row-wise lookup) and 'matrix' (float, columns follow
+    RATE_COLUMNS).
+    """
+    variables = df['Variable']
+    is_hcc = variables.map(lambda v: isinstance(v, str) and v.startswith('HCC'))
+    hcc_rows = df[is_hcc.astype(bool)].drop_duplicates(subset='Variable', keep='first')
+    matrix = hcc_rows[RATE_COLUMNS].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    return {'labels': hcc_rows['Variable'].to_numpy(dtype=object), 'matrix': matrix}
+
+def compile_icd_lookup(icd_to_hcc, hcc_labels):
+    """
+    Compile the ICD -> HCC dict into parallel lookup arrays.
+
+    Returns a dict with 'codes' (ICD codes), 'hcc_labels' (the 'HCC<n>' label
+    each code maps to) and 'hcc_index' (row in the HCC coefficient matrix, or
+    -1 when the label has no coefficient row).
+    """
+    codes = [code for code in icd_to_hcc if isinstance(code, str)]
+    labels = np.array([f"HCC{icd_to_hcc[code]}" for code in codes], dtype=object)
+    hcc_index = pd.Index(hcc_labels).get_indexer(labels).astype(np.int32)
+    return {'codes': np.array(codes, dtype=object), 'hcc_labels': labels, 'hcc_index': hcc_index}
+
+@functools.lru_cache(maxsize=None)
+def demographic_coefficients(year):
+    return compile_demographic_coefficients(demographic_table(year))
+
+@functools.lru_cache(maxsize=None)
+def hcc_coefficients(year):
+    return compile_hcc_coefficients(disease_table(year))
+
+@functools.lru_cache(maxsize=None)
+def icd_lookup(year):
+    return compile_icd_lookup(icd_to_hcc_dict(year), hcc_coefficients(year)['labels'])
+
+@functools.lru_cache(maxsize=None)
+def compiled_tables(year):
+    """Everything the batch scoring engine needs to score one model year."""
+    settings = get_model_year(year)
+    hcc = hcc_coefficients(year)
+    lookup = icd_lookup(year)
+    return {
+        'model_year': int(year),
+        'demographic_coefficients': demographic_coefficients(year),
+        'hcc_labels': hcc['labels'],
+        'hcc_coefficients': hcc['matrix'],
+        'icd_codes': lookup['codes'],
+        'icd_hcc_labels': lookup['hcc_labels'],
+        'icd_hcc_index': lookup['hcc_index'],
+        'normalization_factor': settings['normalization_factor'],
+        'ma_coding_pattern': settings['ma_coding_pattern'],
+        'blend_weight': settings['blend_weight'],
+        'frailty_factor': settings.get('frailty_factor'),
+    }
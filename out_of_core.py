@@ -0,0 +1,190 @@
+import argparse
+import heapq
+import itertools
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from batch_scoring import MEMBER_COLUMNS, flatten_diag_codes, score_members
+from model_years import compiled_tables
+from rollups import RollupAccumulator, member_dimensions, write_summary
+from lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pa = lazy_import('pyarrow')
+pc = lazy_import('pyarrow.compute')
+pq = lazy_import('pyarrow.parquet')
+
+# Scores member files that do not fit in memory. Inputs are memory-mapped
+# Parquet or Arrow IPC files; each row group (or record batch) is scored on
+# its own and appended to the output, so memory use is bounded by the batch
+# size rather than the size of the file. Output sorted by MemberID is built
+# the same way: every batch is sorted on its own into a run file and the runs
+# are combined with a streaming k-way merge.
+
+ARROW_SUFFIXES = ('.arrow', '.feather', '.ipc')
+# Rows held in memory by merge_sorted_runs, across all runs and the output batch
+MERGE_BUFFER_ROWS = 1000000
+
+def is_arrow_file(file_path):
+    return str(file_path).lower().endswith(ARROW_SUFFIXES)
+
+def iter_member_batches(file_path, columns=None, batch_rows=None):
+    """
+    Yield a member file as Arrow tables without reading all of it.
+
+    Parquet files are read one row group at a time (or in `batch_rows`
+    slices when given); Arrow IPC files are memory-mapped and yielded one
+    record batch at a time without copying.
+    """
+    if is_arrow_file(file_path):
+        reader = pa.ipc.open_file(pa.memory_map(str(file_path), 'r'))
+        for i in range(reader.num_record_batches):
+            batch = pa.Table.from_batches([reader.get_batch(i)])
+            yield batch.select(columns) if columns else batch
+        return
+    parquet_file = pq.ParquetFile(str(file_path), memory_map=True)
+    if batch_rows:
+        for batch in parquet_file.iter_batches(batch_size=batch_rows, columns=columns):
+            yield pa.Table.from_batches([batch])
+    else:
+        for i in range(parquet_file.num_row_groups):
+            yield parquet_file.read_row_group(i, columns=columns)
+
+def diag_code_pairs(diag_codes):
+    """
+    (member position, ICD code) arrays for an Arrow Diag_Code column.
+
+    List columns are flattened inside Arrow; string columns hold the same
+    stringified lists as the Excel input and go through flatten_diag_codes.
+    """
+    diag_codes = diag_codes.combine_chunks() if isinstance(diag_codes, pa.ChunkedArray) else diag_codes
+    if pa.types.is_list(diag_codes.type) or pa.types.is_large_list(diag_codes.type):
+        member_pos = pc.list_parent_indices(diag_codes).to_numpy().astype(np.int64)
+        codes = pc.list_flatten(diag_codes).to_numpy(zero_copy_only=False).astype(object)
+        return member_pos, codes
+    return flatten_diag_codes(diag_codes.to_pylist())
+
+def open_writer(output_path, schema):
+    """Incremental writer for Parquet, or Arrow IPC when the path has an Arrow suffix."""
+    if is_arrow_file(output_path):
+        return pa.ipc.new_file(str(output_path), schema)
+    return pq.ParquetWriter(str(output_path), schema)
+
+def sorted_runs_dir(output_path):
+    """Temporary directory for the sorted runs of output_path, next to it."""
+    return tempfile.mkdtemp(prefix='sorted-runs-', dir=os.path.dirname(os.path.abspath(output_path)))
+
+def write_sorted_run(table, run_path):
+    """Write a table of scores sorted by MemberID to a Parquet run file for merge_sorted_runs."""
+    pq.write_table(table.sort_by('MemberID'), str(run_path))
+
+def _run_rows(run_path, batch_rows):
+    for batch in iter_member_batches(run_path, batch_rows=batch_rows):
+        yield from zip(*(column.to_pylist() for column in batch.columns))
+
+def merge_sorted_runs(run_paths, output_path, buffer_rows=MERGE_BUFFER_ROWS):
+    """
+    Merge run files sorted by MemberID (see write_sorted_run) into one sorted
+    file, as weighted_risk_score.combine_sorted_score_files needs.
+
+    Parameters:
+    - run_paths: Parquet run files with the same schema, in input order.
+    - output_path: merged Parquet file (Arrow IPC with an Arrow suffix).
+    - buffer_rows: rows held in memory, split between the runs and the output batch.
+
+    Rows with the same MemberID keep their run order; missing MemberIDs come
+    last, as in Table.sort_by. Returns the number of rows written.
+    """
+    schema = pq.read_schema(str(run_paths[0]))
+    position = schema.get_field_index('MemberID')
+    batch_rows = max(1, buffer_rows // (len(run_paths) + 1))
+    rows = heapq.merge(*(_run_rows(run_path, batch_rows) for run_path in run_paths),
+                       key=lambda row: (row[position] is None, row[position]))
+    writer = open_writer(output_path, schema)
+    n_rows = 0
+    try:
+        while True:
+            chunk = list(itertools.islice(rows, batch_rows))
+            if not chunk:
+                break
+            columns = [pa.array(values, type=field.type) for values, field in zip(zip(*chunk), schema)]
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+            n_rows += len(chunk)
+    finally:
+        writer.close()
+    return n_rows
+
+def score_out_of_core(members_path, output_path, model_year, batch_rows=None, as_of=None, summary_path=None, rollups=None,
+                      sort_members=False):
+    """
+    Score a Parquet/Arrow member file batch by batch and stream the results to output_path.
+
+    The member file needs the MEMBER_COLUMNS; Diag_Code may be a list<string>
+    column or stringified lists. When summary_path is given, cohort rollups
+    (a rollups.RollupAccumulator, default rollups unless one is passed) are
+    accumulated over the same batches and written there at the end. The as-of
+    date defaults to today and is fixed when the run starts, so every batch
+    ages members on the same day. With sort_members the output is sorted by
+    MemberID through per-batch sorted runs (see merge_sorted_runs), so memory
+    stays bounded; otherwise it keeps the input order. Returns the number of
+    members scored.
+    """
+    tables = compiled_tables(model_year)
+    as_of = as_of or datetime.today().date()
+    if summary_path is not None and rollups is None:
+        rollups = RollupAccumulator()
+    columns = MEMBER_COLUMNS
+    if rollups is not None:
+        columns = MEMBER_COLUMNS + member_dimensions(rollups.rollups, rollups.hcc_prevalence_by or ())
+    writer = None
+    schema = None
+    runs_dir = sorted_runs_dir(output_path) if sort_members else None
+    run_paths = []
+    n_scored = 0
+    try:
+        for batch in iter_member_batches(members_path, columns=columns, batch_rows=batch_rows):
+            members = batch.drop_columns(['Diag_Code']).to_pandas()
+            details = {} if rollups is not None else None
+            df_scores = score_members(members, tables, as_of=as_of, diagnoses=diag_code_pairs(batch.column('Diag_Code')), details=details)
+            if rollups is not None:
+                rollups.add(df_scores, details, tables, members=members)
+            table = pa.Table.from_pandas(df_scores, preserve_index=False)
+            if schema is None:
+                schema = table.schema
+            if sort_members:
+                run_paths.append(os.path.join(runs_dir, f"run-{len(run_paths):05d}.parquet"))
+                write_sorted_run(table.cast(schema), run_paths[-1])
+            else:
+                if writer is None:
+                    writer = open_writer(output_path, schema)
+                writer.write_table(table.cast(schema))
+            n_scored += len(df_scores)
+        if run_paths:
+            merge_sorted_runs(run_paths, output_path)
+    finally:
+        if writer is not None:
+            writer.close()
+        if runs_dir is not None:
+            shutil.rmtree(runs_dir, ignore_errors=True)
+    print(f"Scored {n_scored} members from {members_path}; results saved to {output_path}")
+    if summary_path is not None:
+        write_summary(rollups.summary(), summary_path)
+        print(f"Rollup summary saved to {summary_path}")
+    return n_scored
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a Parquet/Arrow member file in bounded memory.")
+    parser.add_argument('members_path')
+    parser.add_argument('output_path')
+    parser.add_argument('--model-year', type=int, default=2024)
+    parser.add_argument('--batch-rows', type=int, default=None, help="rows per batch (default: one row group)")
+    parser.add_argument('--as-of', help="date ages are measured on (default: the day the run starts)")
+    parser.add_argument('--summary', help="also write cohort rollups to this file")
+    parser.add_argument('--sort-members', action='store_true', help="sort the output by MemberID (input order otherwise)")
+    args = parser.parse_args()
+    score_out_of_core(args.members_path, args.output_path, args.model_year, batch_rows=args.batch_rows, as_of=args.as_of,
+                      summary_path=args.summary, sort_members=args.sort_members)
+
+if __name__ == "__main__":
+    main()
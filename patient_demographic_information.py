@@ -1,6 +1,8 @@
-import pandas as pd
 import ast
 from datetime import datetime
+from lazy_imports import lazy_import
+
+pd = lazy_import('pandas')
 
 def load_table_1(file_path):
     df = pd.read_excel(file_path, sheet_name=0, header=0)
@@ -196,9 +198,14 @@ def display_and_sum_values(file_path_1, file_path_2):
     # Save to an Excel file
     df_combined.to_excel("combined_target_values.xlsx", index=False)
 
-# Call the process_code_2 function with appropriate file paths
-table_1_path = 'C:/Users/Spencerdm/OneDrive/Documents/ADT Project/Rate Announcement 2020.xlsx'
-table_2_path_code_1 = 'C:/Users/Spencerdm/Downloads/For HCC (1).xlsx'
-output_path_code_1 = 'C:/Users/Spencerdm/Downloads/Patient_Data_Target_Values.xlsx'
+def main():
+    # Call the process_code_1 function with appropriate file paths
+    table_1_path = 'C:/Users/Spencerdm/OneDrive/Documents/ADT Project/Rate Announcement 2020.xlsx'
+    table_2_path_code_1 = 'C:/Users/Spencerdm/Downloads/For HCC (1).xlsx'
+    output_path_code_1 = 'C:/Users/Spencerdm/Downloads/Patient_Data_Target_Values.xlsx'
+
+    process_code_1(table_1_path, table_2_path_code_1, output_path_code_1)
+
+if __name__ == "__main__":
+    main()
 
-process_code_1(table_1_path, table_2_path_code_1, output_path_code_1)
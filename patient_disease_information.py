@@ -1,7 +1,11 @@
-import pandas as pd
 import os
 from disease_factors import process_code_2  # Import the function from code 2
 from demographic_factors import process_code_1  # Import the function from code 1
+from member_keys import encode_member_ids, scatter_by_key
+from model_years import get_model_year
+from lazy_imports import lazy_import
+
+pd = lazy_import('pandas')
 
 def calculate_adjusted_risk_score(raw_risk_score, normalization_factor, ma_coding_pattern=5.9 / 100):
     """
@@ -26,33 +30,36 @@ def display_and_sum_values(file_path_1, file_path_2, output_file_path):
     df1['Target Value'] = pd.to_numeric(df1['Target Value'], errors='coerce').fillna(0)
     df2['Target Value'] = pd.to_numeric(df2['Target Value'], errors='coerce').fillna(0)
     
-    # Merge the dataframes on 'MemberID'
-    df_combined = pd.merge(df1[['MemberID', 'Target Value']], df2[['MemberID', 'Target Value']], on='MemberID', how='outer', suffixes=('_2020', '_2024'))
-    
-    # Fill NaN values with 0
-    df_combined['Target Value_2020'] = df_combined['Target Value_2020'].fillna(0)
-    df_combined['Target Value_2024'] = df_combined['Target Value_2024'].fillna(0)
+    # Outer join on 'MemberID' through integer keys; members missing from a year get 0
+    (keys_2020, keys_2024), member_ids = encode_member_ids(df1['MemberID'], df2['MemberID'])
+    df_combined = pd.DataFrame({
+        'MemberID': member_ids,
+        'Target Value_2020': scatter_by_key(keys_2020, df1['Target Value'], len(member_ids), fill_value=0.0),
+        'Target Value_2024': scatter_by_key(keys_2024, df2['Target Value'], len(member_ids), fill_value=0.0),
+    })
     
     # Calculate the raw risk scores for 2020 and 2024
     df_combined['Raw Risk Score_2020'] = df_combined['Target Value_2020']
     df_combined['Raw Risk Score_2024'] = df_combined['Target Value_2024']
     
     # Calculate the adjusted risk scores for 2020 and 2024
-    df_combined['Adjusted Risk Score_2020'] = df_combined['Raw Risk Score_2020'].apply(lambda x: calculate_adjusted_risk_score(x, normalization_factor=1.069))
-    df_combined['Adjusted Risk Score_2024'] = df_combined['Raw Risk Score_2024'].apply(lambda x: calculate_adjusted_risk_score(x, normalization_factor=1.015))
+    df_combined['Adjusted Risk Score_2020'] = df_combined['Raw Risk Score_2020'].apply(lambda x: calculate_adjusted_risk_score(
+        x, normalization_factor=get_model_year(2020)['normalization_factor'], ma_coding_pattern=get_model_year(2020)['ma_coding_pattern']))
+    df_combined['Adjusted Risk Score_2024'] = df_combined['Raw Risk Score_2024'].apply(lambda x: calculate_adjusted_risk_score(
+        x, normalization_factor=get_model_year(2024)['normalization_factor'], ma_coding_pattern=get_model_year(2024)['ma_coding_pattern']))
     
     # Calculate the combined adjusted risk score with 30% weight from 2020 and 70% weight from 2024
-    df_combined['Combined Adjusted Risk Score'] = (df_combined['Adjusted Risk Score_2020'] * 0.3) + (df_combined['Adjusted Risk Score_2024'] * 0.7)
+    df_combined['Combined Adjusted Risk Score'] = (df_combined['Adjusted Risk Score_2020'] * get_model_year(2020)['blend_weight']) + (df_combined['Adjusted Risk Score_2024'] * get_model_year(2024)['blend_weight'])
     
     # Load HCC codes and patient categories from the output of process_code_2 (assuming they are included)
     df_hcc_codes = pd.read_excel(file_path_2, usecols=['MemberID', 'HCC Codes', 'Patient Category'])  # Adjust columns as needed
     
     # Assuming age and patient data are included in the demographic file
-    df_patient_data = df1[['MemberID', 'Age']]  # Replace with actual columns if needed
+    df_combined['Age'] = scatter_by_key(keys_2020, df1['Age'], len(member_ids))
     
-    # Merge all dataframes
-    df_combined = pd.merge(df_combined, df_patient_data, on='MemberID', how='left')
-    df_combined = pd.merge(df_combined, df_hcc_codes, on='MemberID', how='left')
+    # The HCC codes come from the same file as df2, so they share its keys
+    for column in ['HCC Codes', 'Patient Category']:
+        df_combined[column] = scatter_by_key(keys_2024, df_hcc_codes[column].to_numpy(dtype=object), len(member_ids))
     
     # Display the relevant data in the terminal
     print("\nComprehensive Risk Scores and Patient Data:")
@@ -0,0 +1,47 @@
+from concurrent.futures import ThreadPoolExecutor
+from model_years import demographic_table, disease_table, icd_to_hcc_dict
+from lazy_imports import lazy_import
+
+pd = lazy_import('pandas')
+
+# Starts every reference-table and member read of a run at once on a thread
+# pool and hands the pipeline futures, so each stage only waits for its own
+# inputs and the remaining reads overlap with scoring.
+
+DEMOGRAPHIC_MEMBER_COLUMNS = ['MemberID', 'DOB', 'Gender', 'Medicaid Dual Status', 'OREC', 'LTI', 'RAFT Code',
+                              'Default Factor Code', 'Medicaid', 'Frailty Indicator', 'Medicaid Add on Factor']
+DISEASE_MEMBER_COLUMNS = ['MemberID', 'LTI', 'Medicaid Dual Status', 'OREC', 'Diag_Code']
+MEMBER_WORKBOOK_COLUMNS = DEMOGRAPHIC_MEMBER_COLUMNS + ['Diag_Code']
+
+def load_member_workbook(file_path):
+    """Read the member workbook once with the columns of both stages."""
+    return pd.read_excel(file_path, usecols=MEMBER_WORKBOOK_COLUMNS)
+
+def prefetch_inputs(executor, model_years=(), member_paths=()):
+    """
+    Schedule every input read of a run on an executor.
+
+    Parameters:
+    - executor: a concurrent.futures executor (usually a ThreadPoolExecutor).
+    - model_years: years whose rate tables and ICD mapping are needed.
+    - member_paths: member workbooks to read.
+
+    Returns:
+    - Dict of futures keyed ('demographic_table', year), ('disease_table', year),
+      ('icd_to_hcc_dict', year) and ('members', path).
+    """
+    futures = {}
+    for year in model_years:
+        futures[('demographic_table', year)] = executor.submit(demographic_table, year)
+        futures[('disease_table', year)] = executor.submit(disease_table, year)
+        futures[('icd_to_hcc_dict', year)] = executor.submit(icd_to_hcc_dict, year)
+    for path in member_paths:
+        futures[('members', path)] = executor.submit(load_member_workbook, path)
+    return futures
+
+def stage_members(members_future, columns):
+    """Wait for a prefetched member frame and return a private copy of one stage's columns."""
+    return members_future.result()[columns].copy()
+
+def prefetch_executor(max_workers=4):
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='prefetch')
@@ -0,0 +1,73 @@
+from batch_scoring import _tables
+from lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Reverse indexes for coding-gap analysis: which ICD codes in a population
+# drive each HCC, how often each appears and in how many members, and which
+# codes did not map to any HCC. Built from the flat (member position, ICD
+# code, lookup row) arrays the scoring pass already holds, with one group-by
+# over all codes rather than another pass over the member rows.
+
+def _decoded(labels):
+    return np.array([label.decode('utf-8') if isinstance(label, bytes) else label for label in labels], dtype=object)
+
+def _distinct_members(keys, member_pos, n_keys):
+    # Members per key: count the distinct (key, member) pairs of each key
+    if len(keys) == 0:
+        return np.zeros(n_keys, dtype=np.int64)
+    bound = int(member_pos.max()) + 1
+    pairs = pd.unique(keys * bound + member_pos)
+    return np.bincount(pairs // bound, minlength=n_keys)
+
+def build_reverse_index(member_pos, codes, icd_pos, tables):
+    """
+    Index the diagnoses of one scoring pass by HCC.
+
+    Parameters:
+    - member_pos, codes, icd_pos: the flat diagnosis arrays (score_members
+      puts them in its details dict as 'member_pos', 'icd_codes', 'icd_pos').
+    - tables: compiled tables (or model year) the codes were looked up in.
+
+    Returns:
+    - Dict of two DataFrames:
+      'hcc_codes': HCC, ICD Code, Code Count (diagnosis lines), Members
+      (members with the code) and HCC Members (members with any code of the
+      HCC), sorted by HCC and descending count;
+      'unmapped': ICD Code, Code Count and Members for codes without an HCC.
+    """
+    tables = _tables(tables)
+    member_pos = np.asarray(member_pos, dtype=np.int64)
+    icd_pos = np.asarray(icd_pos, dtype=np.int64)
+    codes = np.asarray(codes, dtype=object)
+    n_icd = len(tables['icd_codes'])
+
+    # One integer key per distinct code: its lookup row when mapped, after
+    # the lookup rows for unmapped codes
+    mapped = icd_pos >= 0
+    unmapped_index, unmapped_codes = pd.factorize(pd.Series(codes[~mapped], dtype=object).astype(str))
+    keys = np.where(mapped, icd_pos, 0)
+    keys[~mapped] = n_icd + unmapped_index
+    n_keys = n_icd + len(unmapped_codes)
+    code_count = np.bincount(keys, minlength=n_keys)
+    members = _distinct_members(keys, member_pos, n_keys)
+
+    hcc_labels = _decoded(tables['icd_hcc_labels'])
+    hcc_ids, hcc_names = pd.factorize(hcc_labels)
+    hcc_members = _distinct_members(hcc_ids[icd_pos[mapped]].astype(np.int64), member_pos[mapped], len(hcc_names))
+
+    present = np.flatnonzero(code_count[:n_icd])
+    hcc_codes = pd.DataFrame({
+        'HCC': hcc_labels[present],
+        'ICD Code': _decoded(tables['icd_codes'])[present],
+        'Code Count': code_count[present],
+        'Members': members[present],
+        'HCC Members': hcc_members[hcc_ids[present]],
+    }).sort_values(['HCC', 'Code Count', 'ICD Code'], ascending=[True, False, True], ignore_index=True)
+    unmapped = pd.DataFrame({
+        'ICD Code': np.asarray(unmapped_codes, dtype=object),
+        'Code Count': code_count[n_icd:],
+        'Members': members[n_icd:],
+    }).sort_values(['Code Count', 'ICD Code'], ascending=[False, True], ignore_index=True)
+    return {'hcc_codes': hcc_codes, 'unmapped': unmapped}
@@ -0,0 +1,154 @@
+from lazy_imports import lazy_import
+from batch_scoring import member_hcc_pairs
+from model_years import AGE_LABELS, GENDER_LABELS, RATE_COLUMNS
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Cohort and contract level rollups computed while scoring. Each scored chunk
+# is reduced to per-group sums and counts over integer-coded member columns
+# and folded into running totals, so a full population is summarised in the
+# same pass that scores it, without re-reading the member-level output.
+
+SCORE_COLUMNS = ['Target Value_Demographic', 'Target Value_Disease', 'Raw Risk Score',
+                 'Adjusted Risk Score', 'Weighted Risk Score']
+
+# Dimensions the scoring engine already has as integer codes; any other
+# dimension name is taken from the member file column of that name.
+CODED_DIMENSIONS = {
+    'Segment': ('segment', RATE_COLUMNS),
+    'Age Band': ('age_band', AGE_LABELS),
+    'Gender': ('gender', GENDER_LABELS),
+    'Dual Status': ('dual_group', ['NonDual', 'FBDual', 'PBDual']),
+}
+
+DEFAULT_ROLLUPS = {
+    'Model Year': [],
+    'Segment': ['Segment'],
+    'Age Band': ['Age Band'],
+    'Dual Status': ['Dual Status'],
+    'Segment x Age Band x Gender': ['Segment', 'Age Band', 'Gender'],
+}
+DEFAULT_HCC_PREVALENCE_BY = ['Segment']
+
+def member_dimensions(rollups, hcc_prevalence_by=()):
+    """Dimensions that have to be read from the member file."""
+    dimensions = set(hcc_prevalence_by)
+    for keys in rollups.values():
+        dimensions.update(keys)
+    return sorted(dimension for dimension in dimensions if dimension not in CODED_DIMENSIONS)
+
+def _decode(dimension, codes):
+    # Integer codes back to labels; negative codes are the engine's "Unknown"
+    labels = np.array(list(CODED_DIMENSIONS[dimension][1]) + ['Unknown'], dtype=object)
+    codes = np.asarray(codes, dtype=np.int64)
+    return labels[np.where(codes >= 0, codes, len(labels) - 1)]
+
+class RollupAccumulator:
+    """
+    Running group-by totals over scored chunks.
+
+    Parameters:
+    - rollups: dict of rollup name -> list of dimensions (see DEFAULT_ROLLUPS).
+    - hcc_prevalence_by: dimensions HCC prevalence is broken down by, or None
+      to skip it.
+    """
+
+    def __init__(self, rollups=None, hcc_prevalence_by=DEFAULT_HCC_PREVALENCE_BY):
+        self.rollups = DEFAULT_ROLLUPS if rollups is None else rollups
+        self.hcc_prevalence_by = hcc_prevalence_by
+        self.totals = {}
+        self.hcc_totals = None
+        self.group_members = None
+        self.hcc_labels = {}
+
+    def _keys(self, df_scores, details, members, model_year):
+        keys = {'Model Year': np.full(len(df_scores), model_year, dtype=np.int32)}
+        for dimension, (detail_key, _) in CODED_DIMENSIONS.items():
+            keys[dimension] = np.asarray(details[detail_key], dtype=np.int8)
+        for dimension in member_dimensions(self.rollups, self.hcc_prevalence_by or ()):
+            keys[dimension] = members[dimension].to_numpy()
+        return pd.DataFrame(keys)
+
+    def add(self, df_scores, details, tables, members=None, model_year=None):
+        """Fold one scored chunk (score_members output plus its details dict) into the totals."""
+        model_year = tables['model_year'] if model_year is None else model_year
+        keys = self._keys(df_scores, details, members, model_year)
+        chunk = pd.concat([keys, df_scores[SCORE_COLUMNS].reset_index(drop=True)], axis=1)
+        chunk['Members'] = 1
+
+        for name, dimensions in self.rollups.items():
+            by = ['Model Year'] + [d for d in dimensions if d != 'Model Year']
+            partial = chunk.groupby(by, sort=False, dropna=False)[['Members'] + SCORE_COLUMNS].sum()
+            self.totals[name] = partial if name not in self.totals else self.totals[name].add(partial, fill_value=0)
+
+        if self.hcc_prevalence_by is not None:
+            by = ['Model Year'] + [d for d in self.hcc_prevalence_by if d != 'Model Year']
+            group_members = chunk.groupby(by, sort=False, dropna=False)['Members'].sum()
+            self.group_members = group_members if self.group_members is None else self.group_members.add(group_members, fill_value=0)
+            member_pos, hcc = member_hcc_pairs(details['member_pos'], details['icd_pos'], tables)
+            pairs = keys.iloc[member_pos][by].reset_index(drop=True)
+            pairs['HCC'] = hcc
+            counts = pairs.groupby(by + ['HCC'], sort=False, dropna=False).size()
+            self.hcc_totals = counts if self.hcc_totals is None else self.hcc_totals.add(counts, fill_value=0)
+            self.hcc_labels[model_year] = [label.decode('utf-8') if isinstance(label, bytes) else label
+                                           for label in tables['hcc_labels']]
+
+    def merge(self, other):
+        """Fold the totals of another accumulator (e.g. one shard of a run) into this one."""
+        for name, totals in other.totals.items():
+            self.totals[name] = totals if name not in self.totals else self.totals[name].add(totals, fill_value=0)
+        for attribute in ('hcc_totals', 'group_members'):
+            theirs, ours = getattr(other, attribute), getattr(self, attribute)
+            if theirs is not None:
+                setattr(self, attribute, theirs if ours is None else ours.add(theirs, fill_value=0))
+        self.hcc_labels.update(other.hcc_labels)
+
+    def _labelled(self, frame):
+        frame = frame.reset_index()
+        for dimension in CODED_DIMENSIONS:
+            if dimension in frame:
+                frame[dimension] = _decode(dimension, frame[dimension])
+        return frame
+
+    def summary(self):
+        """
+        One long table of every rollup: the group dimensions, member count and
+        the sum and mean of each score column, followed by HCC prevalence rows
+        (HCC, members with the HCC and their share of the group).
+        """
+        frames = []
+        for name, totals in self.totals.items():
+            frame = self._labelled(totals)
+            for column in SCORE_COLUMNS:
+                frame[f"Mean {column}"] = frame[column] / frame['Members']
+                frame = frame.rename(columns={column: f"Sum {column}"})
+            frame.insert(0, 'Rollup', name)
+            frames.append(frame)
+
+        if self.hcc_totals is not None and len(self.hcc_totals):
+            by = list(self.group_members.index.names)
+            prevalence = self.hcc_totals.rename('Members With HCC').reset_index()
+            prevalence = prevalence.merge(self.group_members.rename('Members').reset_index(), on=by, how='left')
+            prevalence['HCC Prevalence'] = prevalence['Members With HCC'] / prevalence['Members']
+            prevalence['HCC'] = [self.hcc_labels[year][hcc] for year, hcc in zip(prevalence['Model Year'], prevalence['HCC'])]
+            prevalence = self._labelled(prevalence.set_index(by))
+            prevalence.insert(0, 'Rollup', 'HCC Prevalence by ' + ' x '.join(by))
+            frames.append(prevalence)
+
+        if not frames:
+            return pd.DataFrame({'Rollup': []})
+        summary = pd.concat(frames, ignore_index=True)
+        summary['Members'] = summary['Members'].astype('int64')
+        if 'Members With HCC' in summary:
+            summary['Members With HCC'] = summary['Members With HCC'].astype('Int64')
+        return summary
+
+def write_summary(summary, output_path):
+    """Write a summary table as Parquet, CSV or Excel depending on the file extension."""
+    if str(output_path).lower().endswith('.parquet'):
+        summary.to_parquet(output_path, index=False)
+    elif str(output_path).lower().endswith('.csv'):
+        summary.to_csv(output_path, index=False)
+    else:
+        summary.to_excel(output_path, index=False)
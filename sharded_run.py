@@ -0,0 +1,375 @@
+import argparse
+import json
+import os
+import pickle
+import shutil
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from batch_scoring import MEMBER_COLUMNS, score_members
+from model_years import compiled_tables, get_model_year, register_model_year
+from out_of_core import diag_code_pairs, is_arrow_file, merge_sorted_runs, open_writer, sorted_runs_dir, write_sorted_run
+from rollups import RollupAccumulator, member_dimensions, write_summary
+from shared_tables import attach_tables, shared_tables
+from stage_cache import file_digest
+from lazy_imports import lazy_import
+
+pa = lazy_import('pyarrow')
+pq = lazy_import('pyarrow.parquet')
+
+# Checkpointed batch runs. A Parquet/Arrow member file is split into shards
+# of whole row groups (record batches for Arrow IPC) and every shard is scored
+# on its own into a file of its own in the run directory. The manifest is
+# written once when the run is planned and pins everything a shard depends on
+# (input digest, model-year settings, as-of date), so shards can be scored in
+# any order by local worker processes or by hosts sharing the directory. A
+# shard counts as done once its output has been renamed into place; workers
+# claim shards with exclusive lock files, so a rerun after a failure only
+# scores what is missing. A lock is a lease: its owner touches it while the
+# shard is scored, and a lock that has not been touched for the lock timeout
+# (or whose owner on this host has died) is broken by the next worker, so a
+# host that dies mid-shard does not hold the shard forever. Outputs are
+# written under per-process temp names, so even two workers that end up on
+# the same shard only ever rename a complete file into place. Local worker
+# processes attach to one shared-memory copy of the compiled tables (see
+# shared_tables.py) instead of each reading the workbooks again. The merge
+# step concatenates the shards in order.
+
+MANIFEST = 'manifest.json'
+DEFAULT_SHARD_ROWS = 500000
+# Seconds without a heartbeat after which a shard lock is broken
+DEFAULT_LOCK_TIMEOUT = 600
+
+# Tables attached by a run_shards worker process
+_worker_tables = None
+
+def _shard_name(run_dir, shard_id, suffix):
+    return os.path.join(run_dir, f"shard-{shard_id:05d}{suffix}")
+
+def _owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _temp_name(path):
+    # Per-process name, so concurrent writers never share a temp file
+    return f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+
+def _unit_rows(members_path):
+    # Rows of each row group (Parquet) or record batch (Arrow IPC)
+    if is_arrow_file(members_path):
+        reader = pa.ipc.open_file(pa.memory_map(str(members_path), 'r'))
+        return [reader.get_batch(i).num_rows for i in range(reader.num_record_batches)]
+    metadata = pq.ParquetFile(str(members_path)).metadata
+    return [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)]
+
+def plan_run(members_path, run_dir, model_year, shard_rows=DEFAULT_SHARD_ROWS, as_of=None, summary=False):
+    """
+    Split a member file into shards and write the run manifest.
+
+    Shards are runs of consecutive row groups holding at least shard_rows rows
+    (a single large row group is one shard). The as-of date defaults to today
+    and is fixed in the manifest so every shard ages members on the same day.
+    Planning an existing run directory returns its manifest unchanged.
+    """
+    manifest_path = os.path.join(run_dir, MANIFEST)
+    if os.path.isfile(manifest_path):
+        return load_manifest(run_dir)
+    os.makedirs(run_dir, exist_ok=True)
+    shards = []
+    start = rows = 0
+    unit_rows = _unit_rows(members_path)
+    for i, n_rows in enumerate(unit_rows):
+        rows += n_rows
+        if rows >= shard_rows or i == len(unit_rows) - 1:
+            shards.append({'id': len(shards), 'units': [start, i + 1], 'rows': rows})
+            start, rows = i + 1, 0
+    manifest = {
+        'members_path': os.path.abspath(members_path),
+        'members_digest': file_digest(members_path),
+        'model_year': int(model_year),
+        'model_year_settings': get_model_year(model_year),
+        'as_of': str(as_of or datetime.today().date()),
+        'summary': bool(summary),
+        'shards': shards,
+    }
+    temp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, default=str)
+    os.replace(temp_path, manifest_path)
+    print(f"Planned {len(shards)} shards of {members_path} in {run_dir}")
+    return manifest
+
+def load_manifest(run_dir):
+    with open(os.path.join(run_dir, MANIFEST)) as manifest_file:
+        return json.load(manifest_file)
+
+def _read_shard(members_path, units, columns):
+    if is_arrow_file(members_path):
+        reader = pa.ipc.open_file(pa.memory_map(str(members_path), 'r'))
+        return pa.Table.from_batches([reader.get_batch(i) for i in range(*units)]).select(columns)
+    return pq.ParquetFile(str(members_path), memory_map=True).read_row_groups(list(range(*units)), columns=columns)
+
+def _claim(run_dir, shard_id, lock_timeout=DEFAULT_LOCK_TIMEOUT):
+    # Exclusive lock file holding "host:pid"; a stale lock is broken and the claim retried
+    lock_path = _shard_name(run_dir, shard_id, '.lock')
+    for _ in range(2):
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                stat = os.stat(lock_path)
+                with open(lock_path) as lock_file:
+                    host, pid = lock_file.read().strip().rsplit(':', 1)
+            except (OSError, ValueError):
+                return False
+            expired = time.time() - stat.st_mtime > lock_timeout
+            if not expired and (host != socket.gethostname() or _pid_alive(int(pid))):
+                return False
+            _break_lock(lock_path, stat)
+            continue
+        with os.fdopen(fd, 'w') as lock_file:
+            lock_file.write(_owner())
+        return True
+    return False
+
+def _break_lock(lock_path, stale):
+    # Only one process can rename the lock aside; the inode and mtime show
+    # whether what it moved is still the stale lock and not a fresh one
+    aside = _temp_name(f"{lock_path}.stale")
+    try:
+        os.rename(lock_path, aside)
+    except FileNotFoundError:
+        return
+    moved = os.stat(aside)
+    if (moved.st_ino, moved.st_mtime_ns) != (stale.st_ino, stale.st_mtime_ns):
+        try:
+            os.link(aside, lock_path)
+        except FileExistsError:
+            pass
+    os.remove(aside)
+
+def _release(lock_path):
+    # Remove the lock unless it was broken and claimed by another worker meanwhile
+    try:
+        with open(lock_path) as lock_file:
+            if lock_file.read().strip() != _owner():
+                return
+        os.remove(lock_path)
+    except FileNotFoundError:
+        pass
+
+@contextmanager
+def _heartbeat(lock_path, interval):
+    # Touch the lock every interval seconds while the shard is scored
+    stop = threading.Event()
+    def beat():
+        while not stop.wait(interval):
+            try:
+                os.utime(lock_path)
+            except OSError:
+                pass
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def is_done(run_dir, shard_id):
+    return os.path.isfile(_shard_name(run_dir, shard_id, '.parquet'))
+
+def score_shard(run_dir, manifest, shard, tables=None):
+    """Score one shard and move its scores (and rollups) into place. Returns the rows scored."""
+    if tables is None:
+        tables = compiled_tables(manifest['model_year'])
+    rollups = RollupAccumulator() if manifest['summary'] else None
+    columns = MEMBER_COLUMNS
+    if rollups is not None:
+        columns = MEMBER_COLUMNS + member_dimensions(rollups.rollups, rollups.hcc_prevalence_by or ())
+    batch = _read_shard(manifest['members_path'], shard['units'], columns)
+    members = batch.drop_columns(['Diag_Code']).to_pandas()
+    details = {} if rollups is not None else None
+    df_scores = score_members(members, tables, as_of=manifest['as_of'], diagnoses=diag_code_pairs(batch.column('Diag_Code')),
+                              details=details)
+
+    # Rollups first, scores last: the scores file is what marks the shard done
+    if rollups is not None:
+        rollups_path = _shard_name(run_dir, shard['id'], '.rollups.pkl')
+        with open(_temp_name(rollups_path), 'wb') as rollups_file:
+            rollups.add(df_scores, details, tables, members=members)
+            pickle.dump(rollups, rollups_file)
+        os.replace(_temp_name(rollups_path), rollups_path)
+    scores_path = _shard_name(run_dir, shard['id'], '.parquet')
+    pq.write_table(pa.Table.from_pandas(df_scores, preserve_index=False), _temp_name(scores_path))
+    os.replace(_temp_name(scores_path), scores_path)
+    return len(df_scores)
+
+def _use_manifest_settings(manifest):
+    # Score with the model-year settings the run was planned with
+    if get_model_year(manifest['model_year']) != manifest['model_year_settings']:
+        register_model_year(manifest['model_year'], **manifest['model_year_settings'])
+
+def work_shards(run_dir, tables=None, lock_timeout=DEFAULT_LOCK_TIMEOUT):
+    """
+    Score every shard of a run that is neither done nor claimed by a live worker.
+
+    Safe to run in several processes or on several hosts at once. A lock not
+    refreshed for lock_timeout seconds is taken over; the lock of a shard being
+    scored is refreshed every quarter of that. tables defaults to the shared
+    tables of a run_shards worker, else the compiled tables of the manifest's
+    model year. Returns the ids of the shards this call scored.
+    """
+    manifest = load_manifest(run_dir)
+    if file_digest(manifest['members_path']) != manifest['members_digest']:
+        raise ValueError(f"{manifest['members_path']} changed since the run was planned; plan a new run")
+    tables = tables if tables is not None else _worker_tables
+    if tables is None:
+        _use_manifest_settings(manifest)
+    scored = []
+    for shard in manifest['shards']:
+        if is_done(run_dir, shard['id']) or not _claim(run_dir, shard['id'], lock_timeout):
+            continue
+        lock_path = _shard_name(run_dir, shard['id'], '.lock')
+        try:
+            if not is_done(run_dir, shard['id']):
+                start = time.perf_counter()
+                with _heartbeat(lock_path, lock_timeout / 4):
+                    n_rows = score_shard(run_dir, manifest, shard, tables)
+                print(f"Shard {shard['id']}: scored {n_rows} members in {time.perf_counter() - start:.2f}s")
+                scored.append(shard['id'])
+        finally:
+            _release(lock_path)
+    return scored
+
+def _init_worker(handle):
+    global _worker_tables
+    _worker_tables = attach_tables(handle)
+
+def run_shards(run_dir, workers=1, lock_timeout=DEFAULT_LOCK_TIMEOUT):
+    """
+    Score the pending shards of a run on `workers` local processes. The tables
+    are compiled and published once; the workers attach to them. Returns the
+    ids scored.
+    """
+    if workers <= 1:
+        return work_shards(run_dir, lock_timeout=lock_timeout)
+    manifest = load_manifest(run_dir)
+    _use_manifest_settings(manifest)
+    with shared_tables(manifest['model_year']) as handle:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(handle,)) as executor:
+            results = [executor.submit(work_shards, run_dir, lock_timeout=lock_timeout) for _ in range(workers)]
+            return sorted(shard_id for result in results for shard_id in result.result())
+
+def shard_status(run_dir):
+    """Number of shards that are done, claimed and pending."""
+    manifest = load_manifest(run_dir)
+    status = {'done': 0, 'claimed': 0, 'pending': 0}
+    for shard in manifest['shards']:
+        if is_done(run_dir, shard['id']):
+            status['done'] += 1
+        elif os.path.isfile(_shard_name(run_dir, shard['id'], '.lock')):
+            status['claimed'] += 1
+        else:
+            status['pending'] += 1
+    return status
+
+def merge_shards(run_dir, output_path, summary_path=None, sort_members=False):
+    """
+    Concatenate the shard scores in input order (or, with sort_members, merge
+    the shards sorted one at a time into MemberID order) into output_path (Parquet or Arrow IPC) and, for runs
+    planned with a summary, merge the shard rollups into summary_path. Fails
+    if any shard is not done. Returns the rows written.
+    """
+    manifest = load_manifest(run_dir)
+    missing = [shard['id'] for shard in manifest['shards'] if not is_done(run_dir, shard['id'])]
+    if missing:
+        raise ValueError(f"{len(missing)} shards are not scored yet (first: {missing[:5]}); run the workers again")
+    writer = None
+    schema = None
+    runs_dir = sorted_runs_dir(output_path) if sort_members else None
+    run_paths = []
+    n_rows = 0
+    try:
+        for shard in manifest['shards']:
+            table = pq.read_table(_shard_name(run_dir, shard['id'], '.parquet'))
+            if schema is None:
+                schema = table.schema
+            if sort_members:
+                run_paths.append(os.path.join(runs_dir, f"shard-{shard['id']:05d}.parquet"))
+                write_sorted_run(table.cast(schema), run_paths[-1])
+            else:
+                if writer is None:
+                    writer = open_writer(output_path, schema)
+                writer.write_table(table.cast(schema))
+            n_rows += table.num_rows
+        if run_paths:
+            merge_sorted_runs(run_paths, output_path)
+    finally:
+        if writer is not None:
+            writer.close()
+        if runs_dir is not None:
+            shutil.rmtree(runs_dir, ignore_errors=True)
+    print(f"Merged {len(manifest['shards'])} shards ({n_rows} members) into {output_path}")
+    if summary_path is not None and manifest['summary']:
+        rollups = RollupAccumulator()
+        for shard in manifest['shards']:
+            with open(_shard_name(run_dir, shard['id'], '.rollups.pkl'), 'rb') as rollups_file:
+                rollups.merge(pickle.load(rollups_file))
+        write_summary(rollups.summary(), summary_path)
+        print(f"Rollup summary saved to {summary_path}")
+    return n_rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a Parquet/Arrow member file in resumable shards.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    plan = commands.add_parser('plan', help="split the member file into shards and write the manifest")
+    run = commands.add_parser('run', help="plan (if needed), score the pending shards and merge")
+    for command in (plan, run):
+        command.add_argument('members_path')
+        command.add_argument('run_dir')
+        command.add_argument('--model-year', type=int, default=2024)
+        command.add_argument('--shard-rows', type=int, default=DEFAULT_SHARD_ROWS)
+        command.add_argument('--as-of', help="date ages are measured on (default: the day the run is planned)")
+    work = commands.add_parser('work', help="score pending shards (run on every worker host)")
+    work.add_argument('run_dir')
+    merge = commands.add_parser('merge', help="combine the scored shards")
+    merge.add_argument('run_dir')
+    status = commands.add_parser('status', help="count done, claimed and pending shards")
+    status.add_argument('run_dir')
+    for command in (run, work):
+        command.add_argument('--workers', type=int, default=1, help="local worker processes")
+        command.add_argument('--lock-timeout', type=float, default=DEFAULT_LOCK_TIMEOUT,
+                             help="seconds after which the lock of a worker that stopped refreshing it is broken")
+    for command in (run, merge):
+        command.add_argument('--output', required=command is merge, help="merged scores (.parquet or .arrow)")
+        command.add_argument('--summary', help="also write merged cohort rollups to this file")
+        command.add_argument('--sort-members', action='store_true', help="sort the merged scores by MemberID")
+    plan.add_argument('--summary', action='store_true', help="keep per-shard rollups for a merged summary")
+    args = parser.parse_args(argv)
+
+    if args.command in ('plan', 'run'):
+        plan_run(args.members_path, args.run_dir, args.model_year, shard_rows=args.shard_rows, as_of=args.as_of,
+                 summary=bool(args.summary))
+    if args.command in ('work', 'run'):
+        run_shards(args.run_dir, workers=args.workers, lock_timeout=args.lock_timeout)
+    if args.command == 'status':
+        print(shard_status(args.run_dir))
+    if args.command == 'merge' or args.command == 'run' and args.output:
+        merge_shards(args.run_dir, args.output, summary_path=args.summary, sort_members=args.sort_members)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from batch_scoring import score_members
+from model_years import compiled_tables
+from lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Publishes a compiled model-year bundle (see model_years.compiled_tables) in
+# shared memory once, so worker processes attach to the same read-only
+# buffers instead of re-reading the workbooks and building their own copies.
+# Label arrays are stored as fixed-width bytes and the ICD codes are sorted,
+# which lets workers look codes up with a binary search on the shared array
+# instead of building a hash index of their own.
+
+ARRAY_KEYS = ['demographic_coefficients', 'hcc_coefficients', 'hcc_labels',
+              'icd_codes', 'icd_hcc_labels', 'icd_hcc_index']
+SCALAR_KEYS = ['model_year', 'normalization_factor', 'ma_coding_pattern', 'blend_weight', 'frailty_factor']
+
+# Blocks attached by this process; kept referenced so their buffers stay valid
+_attached_blocks = {}
+_worker_tables = None
+
+def _as_bytes(labels):
+    return np.array([str(label).encode('utf-8') for label in labels], dtype=bytes)
+
+def _shareable_arrays(tables):
+    # ICD codes sorted (with their parallel arrays) and every label array as fixed-width bytes
+    order = np.argsort(_as_bytes(tables['icd_codes']), kind='stable')
+    return {
+        'demographic_coefficients': np.ascontiguousarray(tables['demographic_coefficients']),
+        'hcc_coefficients': np.ascontiguousarray(tables['hcc_coefficients']),
+        'hcc_labels': _as_bytes(tables['hcc_labels']),
+        'icd_codes': _as_bytes(tables['icd_codes'])[order],
+        'icd_hcc_labels': _as_bytes(tables['icd_hcc_labels'])[order],
+        'icd_hcc_index': np.ascontiguousarray(tables['icd_hcc_index'][order]),
+    }
+
+def publish_tables(tables):
+    """
+    Copy a compiled table bundle into shared memory.
+
+    Parameters:
+    - tables: compiled tables from model_years.compiled_tables, or a model year.
+
+    Returns:
+    - (handle, blocks): the handle is a small picklable dict to pass to
+      workers; the blocks must be kept open by the publisher and released
+      with release_tables when the workers are done.
+    """
+    if not isinstance(tables, dict):
+        tables = compiled_tables(tables)
+    handle = {'scalars': {key: tables[key] for key in SCALAR_KEYS}, 'arrays': {}}
+    blocks = []
+    try:
+        for key, array in _shareable_arrays(tables).items():
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append(block)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            handle['arrays'][key] = (block.name, array.dtype.str, array.shape)
+    except Exception:
+        release_tables(blocks)
+        raise
+    return handle, blocks
+
+def release_tables(blocks):
+    """Close and unlink blocks created by publish_tables."""
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+def _open_block(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 has no track argument; workers started by
+        # multiprocessing share the publisher's resource tracker, so the
+        # segment is still unlinked only once.
+        return shared_memory.SharedMemory(name=name)
+
+def attach_tables(handle):
+    """
+    Attach to published tables without copying them.
+
+    Returns a table bundle usable by batch_scoring whose arrays are read-only
+    views of the shared buffers.
+    """
+    tables = dict(handle['scalars'])
+    tables['icd_sorted'] = True
+    for key, (name, dtype, shape) in handle['arrays'].items():
+        block = _attached_blocks.get(name)
+        if block is None:
+            block = _attached_blocks[name] = _open_block(name)
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        array.flags.writeable = False
+        tables[key] = array
+    return tables
+
+def detach_tables():
+    """Close every block this process attached to."""
+    for block in _attached_blocks.values():
+        block.close()
+    _attached_blocks.clear()
+
+@contextlib.contextmanager
+def shared_tables(tables):
+    """Publish tables for the duration of a with-block and yield the handle."""
+    handle, blocks = publish_tables(tables)
+    try:
+        yield handle
+    finally:
+        release_tables(blocks)
+
+def _init_worker(handle):
+    global _worker_tables
+    _worker_tables = attach_tables(handle)
+
+def _score_chunk(members):
+    return score_members(members, _worker_tables)
+
+def parallel_score(members, model_year, workers=4, chunk_rows=50000):
+    """
+    Score a member frame on several worker processes sharing one copy of the tables.
+
+    Returns the same frame as batch_scoring.score_members, in input order.
+    """
+    chunks = [members.iloc[start:start + chunk_rows] for start in range(0, len(members), chunk_rows)]
+    with shared_tables(model_year) as handle:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(handle,)) as executor:
+            results = list(executor.map(_score_chunk, chunks))
+    if not results:
+        return score_members(members, model_year)
+    return pd.concat(results, ignore_index=True)
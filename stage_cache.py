@@ -0,0 +1,109 @@
+import hashlib
+import importlib.util
+import json
+import os
+import pickle
+from lazy_imports import lazy_import
+
+pd = lazy_import('pandas')
+
+# On-disk cache of stage outputs (the DataFrames process_code_1 and
+# process_code_2 produce). Entries are addressed by a hash of everything the
+# stage output depends on: the content of its input files, the model-year
+# settings it reads, the source of the code that computes it and any extra
+# parameters such as the as-of date. The store is bounded in size and evicts
+# the least recently used entries first.
+
+DEFAULT_CACHE_DIR = os.environ.get('HCC_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'hcc-risk-adjustment'))
+DEFAULT_MAX_BYTES = int(os.environ.get('HCC_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+
+_file_digests = {}
+
+def file_digest(file_path):
+    """SHA-256 of a file's content, memoized per (path, size, mtime) for the life of the process."""
+    stat = os.stat(file_path)
+    memo_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _file_digests:
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as source:
+            for block in iter(lambda: source.read(1024 * 1024), b''):
+                digest.update(block)
+        _file_digests[memo_key] = digest.hexdigest()
+    return _file_digests[memo_key]
+
+def code_digest(module_or_path):
+    """Digest of the source of a module (by name) or a source file (by path)."""
+    if os.path.isfile(module_or_path):
+        return file_digest(module_or_path)
+    return file_digest(importlib.util.find_spec(module_or_path).origin)
+
+class StageCache:
+    """
+    Size-bounded, least-recently-used store of stage output frames.
+
+    Parameters:
+    - cache_dir: directory holding the entries (HCC_CACHE_DIR or ~/.cache/hcc-risk-adjustment).
+    - max_bytes: total size the store is trimmed to after every write.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.results = []
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, stage, files=(), code=(), **params):
+        """Hash of a stage's input file contents, code version and parameters."""
+        key_parts = {
+            'stage': stage,
+            'files': [file_digest(path) for path in files],
+            'code': [code_digest(module) for module in code],
+            'params': params,
+        }
+        return hashlib.sha256(json.dumps(key_parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def _entry_path(self, stage, key):
+        return os.path.join(self.cache_dir, f"{stage}-{key}.pkl")
+
+    def load(self, stage, key):
+        """Return the cached frame for a stage, or None on a miss."""
+        entry_path = self._entry_path(stage, key)
+        try:
+            df = pd.read_pickle(entry_path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.results.append((stage, 'miss'))
+            return None
+        # Touch the entry so eviction sees it as recently used
+        os.utime(entry_path)
+        self.results.append((stage, 'hit'))
+        return df
+
+    def store(self, stage, key, df):
+        """Write a stage output and evict old entries beyond max_bytes."""
+        entry_path = self._entry_path(stage, key)
+        temp_path = f"{entry_path}.{os.getpid()}.tmp"
+        df.to_pickle(temp_path)
+        os.replace(temp_path, entry_path)
+        self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until the store fits in max_bytes."""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith('.pkl'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def report(self):
+        """Print and return the hit/miss outcome of every stage looked up so far."""
+        hits = sum(1 for _, outcome in self.results if outcome == 'hit')
+        print(f"\nStage cache ({self.cache_dir}): {hits} hit(s), {len(self.results) - hits} miss(es)")
+        for stage, outcome in self.results:
+            print(f"  {stage}: {outcome}")
+        return list(self.results)
@@ -1,4 +1,14 @@
-import pandas as pd
+import argparse
+import heapq
+import itertools
+from operator import itemgetter
+from member_keys import encode_member_ids, scatter_by_key
+from lazy_imports import lazy_import
+
+pa = lazy_import('pyarrow')
+pd = lazy_import('pandas')
+
+STREAM_BATCH_ROWS = 65536
 
 def load_weighted_risk_scores(file_path):
     """Load the weighted risk scores from an Excel file."""
@@ -11,14 +21,13 @@ def combine_weighted_risk_scores(file_path_2020, file_path_2024, output_path):
     df_2020 = load_weighted_risk_scores(file_path_2020)
     df_2024 = load_weighted_risk_scores(file_path_2024)
     
-    # Merge the dataframes on 'MemberID'
-    df_combined = pd.merge(df_2020[['MemberID', 'Weighted Risk Score']], 
-                           df_2024[['MemberID', 'Weighted Risk Score']], 
-                           on='MemberID', how='outer', suffixes=('_2020', '_2024'))
-    
-    # Fill NaN values with 0
-    df_combined['Weighted Risk Score_2020'] = df_combined['Weighted Risk Score_2020'].fillna(0)
-    df_combined['Weighted Risk Score_2024'] = df_combined['Weighted Risk Score_2024'].fillna(0)
+    # Outer join on 'MemberID' through integer keys; members missing from a year get 0
+    (keys_2020, keys_2024), member_ids = encode_member_ids(df_2020['MemberID'], df_2024['MemberID'])
+    df_combined = pd.DataFrame({
+        'MemberID': member_ids,
+        'Weighted Risk Score_2020': scatter_by_key(keys_2020, df_2020['Weighted Risk Score'], len(member_ids), fill_value=0.0),
+        'Weighted Risk Score_2024': scatter_by_key(keys_2024, df_2024['Weighted Risk Score'], len(member_ids), fill_value=0.0),
+    })
     
     # Calculate the total weighted risk score for each patient
     df_combined['Total Weighted Risk Score'] = df_combined['Weighted Risk Score_2020'] + df_combined['Weighted Risk Score_2024']
@@ -31,7 +40,122 @@ def combine_weighted_risk_scores(file_path_2020, file_path_2024, output_path):
     df_combined.to_excel(output_path, index=False)
     print(f"Combined weighted risk scores have been saved to {output_path}")
 
-def main():
+def iter_member_scores(file_path, score_column='Weighted Risk Score', batch_rows=STREAM_BATCH_ROWS):
+    """
+    Stream (MemberID, score) pairs from a Parquet/Arrow score file sorted by MemberID.
+
+    Blank scores count as 0, as in load_weighted_risk_scores. Raises
+    ValueError when the file is not sorted by unique MemberIDs.
+    """
+    from out_of_core import iter_member_batches
+    previous = None
+    for batch in iter_member_batches(file_path, columns=['MemberID', score_column], batch_rows=batch_rows):
+        for member_id, score in zip(batch.column('MemberID').to_pylist(), batch.column(score_column).to_pylist()):
+            if previous is not None and not previous < member_id:
+                raise ValueError(f"{file_path} is not sorted by unique MemberID ({member_id!r} follows {previous!r})")
+            previous = member_id
+            yield member_id, 0.0 if score is None or score != score else score
+
+def _member_id_type(file_path):
+    # Arrow type of the MemberID column, read from the file's schema only
+    from out_of_core import is_arrow_file
+    if is_arrow_file(file_path):
+        schema = pa.ipc.open_file(pa.memory_map(str(file_path), 'r')).schema
+    else:
+        import pyarrow.parquet as pq
+        schema = pq.read_schema(str(file_path))
+    return schema.field('MemberID').type
+
+def _tagged(stream_index, stream):
+    # (MemberID, stream, score) so the merge orders ties by input file
+    for member_id, score in stream:
+        yield member_id, stream_index, score
+
+def combine_sorted_score_files(year_files, output_path, weights=None, score_column='Weighted Risk Score',
+                               batch_rows=STREAM_BATCH_ROWS):
+    """
+    Combine any number of per-year score files with a streaming k-way merge.
+
+    Parameters:
+    - year_files: dict of model year -> Parquet/Arrow score file, each sorted by MemberID.
+    - output_path: combined Parquet file (Arrow IPC with an Arrow suffix).
+    - weights: dict of model year -> weight applied to that year's score
+      (default 1 for every year, for scores that are already weighted).
+    - score_column: score column read from every file.
+    - batch_rows: rows read per file and written per output batch.
+
+    The output has MemberID (the union of all files, in order), one
+    '<score_column>_<year>' column per year holding the weighted score (0 for
+    members missing from that year) and the Total Weighted Risk Score. Only
+    one batch per file and one output batch are held in memory at a time.
+    Returns the number of members written.
+    """
+    from out_of_core import open_writer
+    years = list(year_files)
+    weights = [float((weights or {}).get(year, 1.0)) for year in years]
+    year_columns = [f"{score_column}_{year}" for year in years]
+    streams = [_tagged(i, iter_member_scores(year_files[year], score_column, batch_rows)) for i, year in enumerate(years)]
+    id_type = _member_id_type(year_files[years[0]])
+
+    writer = None
+    n_members = 0
+    buffer_ids, buffer_scores = [], []
+
+    def flush():
+        nonlocal writer
+        columns = {'MemberID': pa.array(buffer_ids, type=id_type)}
+        for i, column in enumerate(year_columns):
+            columns[column] = pa.array([scores[i] for scores in buffer_scores], type=pa.float64())
+        columns['Total Weighted Risk Score'] = pa.array([sum(scores) for scores in buffer_scores], type=pa.float64())
+        table = pa.table(columns)
+        if writer is None:
+            writer = open_writer(output_path, table.schema)
+        writer.write_table(table)
+        buffer_ids.clear()
+        buffer_scores.clear()
+
+    try:
+        for member_id, rows in itertools.groupby(heapq.merge(*streams), key=itemgetter(0)):
+            scores = [0.0] * len(years)
+            for _, stream_index, score in rows:
+                scores[stream_index] = score * weights[stream_index]
+            buffer_ids.append(member_id)
+            buffer_scores.append(scores)
+            n_members += 1
+            if len(buffer_ids) >= batch_rows:
+                flush()
+        if buffer_ids or writer is None:
+            flush()
+    finally:
+        if writer is not None:
+            writer.close()
+    print(f"Combined {len(years)} model years into {n_members} members; saved to {output_path}")
+    return n_members
+
+def _year_option(text):
+    # "2024=path" -> (2024, "path")
+    year, _, value = text.partition('=')
+    if not value:
+        raise argparse.ArgumentTypeError(f"expected YEAR=VALUE, got {text!r}")
+    return int(year), value
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Combine per-year risk scores. Without inputs the 2020 and 2024 workbooks are combined.")
+    parser.add_argument('inputs', nargs='*', type=_year_option,
+                        help="YEAR=PATH of a Parquet/Arrow score file sorted by MemberID (any number of years)")
+    parser.add_argument('-o', '--output', help="combined Parquet/Arrow output")
+    parser.add_argument('-w', '--weight', type=_year_option, action='append', default=[],
+                        help="YEAR=WEIGHT applied to that year's scores (default 1)")
+    parser.add_argument('--score-column', default='Weighted Risk Score')
+    args = parser.parse_args(argv)
+
+    if args.inputs:
+        if not args.output:
+            parser.error("--output is required when combining score files")
+        weights = {year: float(weight) for year, weight in args.weight}
+        combine_sorted_score_files(dict(args.inputs), args.output, weights=weights, score_column=args.score_column)
+        return
+
     # File paths for weighted risk scores
     file_path_2020 = 'C:/Users/Spencerdm/Downloads/Comprehensive_Risk_Scores_with_Patient_Data_2020.xlsx'
     file_path_2024 = 'C:/Users/Spencerdm/Downloads/Comprehensive_Risk_Scores_with_Patient_Data_2024.xlsx'